@@ -0,0 +1,152 @@
+## summary of the code below ##
+## Helpers for the FAISS index types a VectorStore can use:
+##   flat  exact brute-force search (IndexFlatL2), the original behaviour
+##   ivf   IVF-Flat; trained on the vectors it is built from and retrained once the corpus outgrows its nlist
+##   hnsw  HNSW graph over full vectors
+##   auto  flat up to a chunk-count threshold, then the configured approximate type
+## nprobe (ivf) and efSearch (hnsw) have index-wide defaults and can be overridden per search
+## through faiss SearchParameters, so concurrent queries never mutate the shared index.
+## Vector storage inside the index is one of:
+##   full  float32 vectors (4 bytes per dimension)
+##   fp16  float16 scalar quantization (2x smaller)
+##   sq8   8-bit scalar quantization (4x smaller)
+##   pq    product quantization with one byte per 4 dimensions (16x smaller); sq8 is used until there are
+##         enough vectors to train the codebooks
+## With compressed storage the full vectors live in a VectorFile and are used to re-rank the top candidates.
+#################
+
+import math
+import numbers
+
+import numpy as np
+import faiss
+
+INDEX_TYPES = ("flat", "ivf", "hnsw", "auto")
+STORAGE_TYPES = ("full", "fp16", "sq8", "pq")
+
+# Codes appended to the factory string of each index type
+_STORAGE_CODES = {"full": "Flat", "fp16": "SQfp16", "sq8": "SQ8"}
+
+# faiss warns below ~39 training points per centroid
+MIN_POINTS_PER_CENTROID = 39
+
+# PQ trains 256 centroids per sub-quantizer
+PQ_MIN_TRAIN = MIN_POINTS_PER_CENTROID * 256
+
+
+def nlist_for(count):
+    return max(1, min(int(4 * math.sqrt(count)), count // MIN_POINTS_PER_CENTROID))
+
+
+def resolve_kind(index_type, count, ann_threshold, auto_index_type):
+    if index_type == "auto":
+        return auto_index_type if count > ann_threshold else "flat"
+    return index_type
+
+
+def resolve_storage(storage, count):
+    return "sq8" if storage == "pq" and count < PQ_MIN_TRAIN else storage
+
+
+def pq_subquantizers(dimension):
+    # One byte code per sub-vector of about four dimensions; m must divide the dimension
+    for m in range(max(1, dimension // 4), 0, -1):
+        if dimension % m == 0:
+            return m
+
+
+def index_kind(index):
+    if faiss.try_extract_index_ivf(index) is not None:
+        return "ivf"
+    if isinstance(faiss.downcast_index(index), faiss.IndexHNSW):
+        return "hnsw"
+    return "flat"
+
+
+def index_storage(index):
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexHNSW):
+        index = faiss.downcast_index(index.storage)
+    if isinstance(index, (faiss.IndexPQ, faiss.IndexIVFPQ)):
+        return "pq"
+    if isinstance(index, (faiss.IndexScalarQuantizer, faiss.IndexIVFScalarQuantizer)):
+        return "fp16" if index.sq.qtype == faiss.ScalarQuantizer.QT_fp16 else "sq8"
+    return "full"
+
+
+def needs_retrain(index, count):
+    # Retrain once the ideal number of lists has doubled, i.e. the lists are about four times too long
+    ivf = faiss.try_extract_index_ivf(index)
+    return ivf is not None and nlist_for(count) >= 2 * ivf.nlist
+
+
+def build_index(kind, vectors, nprobe=16, ef_search=64, hnsw_m=32, storage="full"):
+    dimension = vectors.shape[1]
+    storage = resolve_storage(storage, len(vectors))
+    codes = f"PQ{pq_subquantizers(dimension)}" if storage == "pq" else _STORAGE_CODES[storage]
+    if kind == "ivf":
+        index = faiss.index_factory(dimension, f"IVF{nlist_for(len(vectors))},{codes}")
+        index.nprobe = nprobe
+    elif kind == "hnsw":
+        index = faiss.index_factory(dimension, f"HNSW{hnsw_m}" if storage == "full" else f"HNSW{hnsw_m}_{codes}")
+        index.hnsw.efSearch = ef_search
+    elif kind == "flat":
+        index = faiss.IndexFlatL2(dimension) if storage == "full" else faiss.index_factory(dimension, codes)
+    else:
+        raise ValueError(f"Unknown index type: {kind}")
+    if not index.is_trained:
+        index.train(vectors)
+    index.add(vectors)
+    return index
+
+
+def copy_index(index, mapped=False):
+    # Owned in-memory copy. An index memory-mapped from a snapshot goes through a serialized buffer, since
+    # faiss.clone_index would keep viewing its pages; an in-memory one is cloned without that extra buffer.
+    if mapped:
+        return faiss.deserialize_index(faiss.serialize_index(index))
+    return faiss.clone_index(index)
+
+
+def index_vectors(index, mapped=False):
+    # IVF needs a direct map to reconstruct by row; rows were added without explicit ids so they are sequential.
+    # Building the map changes the index, so it is done on a copy that concurrent searches do not use.
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        index = copy_index(index, mapped)
+        faiss.try_extract_index_ivf(index).make_direct_map()
+    if index.ntotal == 0:
+        return np.zeros((0, index.d), dtype=np.float32)
+    return index.reconstruct_n(0, index.ntotal)
+
+
+def index_bytes(index):
+    # Rough in-memory size: the stored codes plus HNSW graph links or IVF list ids
+    if index is None:
+        return 0
+    kind = index_kind(index)
+    if kind == "hnsw":
+        hnsw = faiss.downcast_index(index)
+        return hnsw.ntotal * (faiss.downcast_index(hnsw.storage).sa_code_size() + 4 * hnsw.hnsw.nb_neighbors(0))
+    # IVF codes include the list number; flat indexes have no overhead
+    return index.ntotal * index.sa_code_size() + (index.ntotal * 8 if kind == "ivf" else 0)
+
+
+def search_setting(name, value):
+    # Per-query nprobe / ef_search: None keeps the index's own setting, anything else must be a positive int
+    if value is None:
+        return None
+    if isinstance(value, bool) or not isinstance(value, numbers.Integral) or value < 1:
+        raise ValueError(f"{name} must be a positive integer")
+    return int(value)
+
+
+def search_params(index, nprobe=None, ef_search=None):
+    nprobe = search_setting("nprobe", nprobe)
+    ef_search = search_setting("ef_search", ef_search)
+    kind = index_kind(index)
+    if kind == "ivf" and nprobe:
+        return faiss.SearchParametersIVF(nprobe=nprobe)
+    if kind == "hnsw" and ef_search:
+        return faiss.SearchParametersHNSW(efSearch=ef_search)
+    return None
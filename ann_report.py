@@ -0,0 +1,107 @@
+## summary of the code below ##
+## Recall-vs-latency report for the approximate index types, measured against the exact flat index.
+## Vectors come from the current API snapshot (--snapshot) or are generated synthetically (--synthetic N).
+## Queries are corpus vectors with a little noise added, so no embedding calls are needed.
+## Example:
+##   python ann_report.py --snapshot snapshot --nprobe 1 4 16 64 --ef-search 16 32 64 128 --json ann_report.json
+#################
+
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+import faiss
+
+from ann_index import build_index, index_vectors, search_params
+from snapshot import current_version
+
+
+def load_vectors(args):
+    if args.snapshot:
+        version = current_version(args.snapshot)
+        if version is None:
+            raise SystemExit(f"No snapshot found in {args.snapshot}")
+        return index_vectors(faiss.read_index(os.path.join(args.snapshot, version, "index.faiss"))).astype(np.float32)
+    rng = np.random.default_rng(args.seed)
+    # Clustered data is closer to real embeddings than uniform noise
+    centers = rng.standard_normal((max(1, args.synthetic // 100), args.dim)).astype(np.float32)
+    return centers[rng.integers(0, len(centers), args.synthetic)] + 0.3 * rng.standard_normal((args.synthetic, args.dim)).astype(np.float32)
+
+
+def timed_search(index, queries, k, params):
+    latencies = []
+    results = []
+    for query in queries:
+        start = time.perf_counter()
+        _, indices = index.search(query[None, :], k, params=params)
+        latencies.append(time.perf_counter() - start)
+        results.append(indices[0])
+    return np.array(results), np.array(latencies) * 1000
+
+
+def recall(results, truth):
+    return float(np.mean([len(set(r) & set(t)) / len(t) for r, t in zip(results, truth)]))
+
+
+def summarize(name, setting, build_seconds, results, truth, latencies):
+    return {
+        "index": name,
+        "setting": setting,
+        "build_seconds": round(build_seconds, 3),
+        "recall_at_k": round(recall(results, truth), 4),
+        "latency_ms_p50": round(float(np.percentile(latencies, 50)), 4),
+        "latency_ms_p95": round(float(np.percentile(latencies, 95)), 4),
+        "latency_ms_mean": round(float(latencies.mean()), 4),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare recall and latency of FAISS index types against exact search.")
+    parser.add_argument("--snapshot", help="snapshot directory written by the API")
+    parser.add_argument("--synthetic", type=int, default=100000, help="number of synthetic vectors when no snapshot is given")
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--nprobe", type=int, nargs="*", default=[1, 4, 16, 64])
+    parser.add_argument("--ef-search", type=int, nargs="*", default=[16, 32, 64, 128])
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="also write the report to this file")
+    args = parser.parse_args()
+
+    vectors = load_vectors(args)
+    rng = np.random.default_rng(args.seed)
+    queries = vectors[rng.integers(0, len(vectors), args.queries)]
+    queries = queries + 0.01 * queries.std() * rng.standard_normal(queries.shape).astype(np.float32)
+    k = min(args.k, len(vectors))
+
+    rows = []
+    start = time.perf_counter()
+    flat = build_index("flat", vectors)
+    flat_build = time.perf_counter() - start
+    truth, latencies = timed_search(flat, queries, k, None)
+    rows.append(summarize("flat", None, flat_build, truth, truth, latencies))
+
+    for kind, settings in (("ivf", args.nprobe), ("hnsw", args.ef_search)):
+        start = time.perf_counter()
+        index = build_index(kind, vectors)
+        build_seconds = time.perf_counter() - start
+        for setting in settings:
+            params = search_params(index, nprobe=setting) if kind == "ivf" else search_params(index, ef_search=setting)
+            results, latencies = timed_search(index, queries, k, params)
+            rows.append(summarize(kind, {"nprobe" if kind == "ivf" else "ef_search": setting}, build_seconds, results, truth, latencies))
+
+    print(f"{len(vectors)} vectors, {vectors.shape[1]} dimensions, {len(queries)} queries, k={k}")
+    print(f"{'index':<6} {'setting':<16} {'build s':>8} {'recall':>7} {'p50 ms':>8} {'p95 ms':>8}")
+    for row in rows:
+        setting = ", ".join(f"{key}={value}" for key, value in (row["setting"] or {}).items()) or "exact"
+        print(f"{row['index']:<6} {setting:<16} {row['build_seconds']:>8} {row['recall_at_k']:>7} {row['latency_ms_p50']:>8} {row['latency_ms_p95']:>8}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"vectors": len(vectors), "dimension": int(vectors.shape[1]), "queries": len(queries), "k": k, "results": rows}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
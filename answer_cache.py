@@ -0,0 +1,158 @@
+## summary of the code below ##
+## Layered in-process cache for /ask. The model runs at temperature 0, so a repeated question over an unchanged
+## index gets the same answer and can skip retrieval and the LLM call entirely.
+##   query embeddings  LRU of normalized question -> query embedding; independent of the index
+##   exact answers     (namespace, normalized question, search settings) -> answer, for the current index version
+##   semantic answers  optional; reuses the answer of a cached question whose embedding has a cosine
+##                     similarity of at least semantic_threshold with the new one (same search settings)
+## Every layer has a TTL and an entry limit with least-recently-used eviction. Answers are tied to
+## VectorStore.version and dropped as soon as a question arrives for a newer version of the index.
+## Each namespace (a named collection in api.py) has its own index, so its answers and versions are kept apart.
+#################
+
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+
+def normalize(question):
+    return " ".join(question.lower().split())
+
+
+class TTLCache:
+    def __init__(self, max_entries=1000, ttl=3600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and self.ttl and time.monotonic() - entry[0] > self.ttl:
+                del self.entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value):
+        if self.max_entries <= 0:
+            return
+        with self.lock:
+            self.entries[key] = (time.monotonic(), value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def discard(self, predicate):
+        # Removes the entries whose key matches
+        with self.lock:
+            for key in [key for key in self.entries if predicate(key)]:
+                del self.entries[key]
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+class AnswerCache:
+    def __init__(self, max_answers=1000, answer_ttl=3600, max_embeddings=10000, embedding_ttl=86400,
+                 semantic_threshold=None):
+        self.embeddings = TTLCache(max_embeddings, embedding_ttl)
+        self.answers = TTLCache(max_answers, answer_ttl)
+        self.semantic_threshold = semantic_threshold
+        self.semantic_hits = 0
+        self.lock = threading.Lock()
+        # Index version per namespace
+        self.versions = {}
+
+    def query_embedding(self, question, embed_query):
+        key = normalize(question)
+        embedding = self.embeddings.get(key)
+        if embedding is None:
+            embedding = embed_query(question)
+            self.embeddings.put(key, embedding)
+        return embedding
+
+    def query_embeddings(self, questions, embed_queries):
+        # Misses are embedded together in one call
+        embeddings = [self.embeddings.get(normalize(question)) for question in questions]
+        missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        if missing:
+            for i, embedding in zip(missing, embed_queries([questions[i] for i in missing])):
+                embeddings[i] = embedding
+                self.embeddings.put(normalize(questions[i]), embedding)
+        return embeddings
+
+    def _check_version(self, version, namespace):
+        # Versions only grow; a request that started before the index changed must not bring back old answers
+        with self.lock:
+            current = self.versions.get(namespace)
+            if current is None or version > current:
+                if current is not None:
+                    self.answers.discard(lambda key: key[0] == namespace)
+                self.versions[namespace] = current = version
+            return version == current
+
+    def get(self, question, version, settings=None, namespace=None):
+        if not self._check_version(version, namespace):
+            return None
+        entry = self.answers.get((namespace, normalize(question), settings))
+        return entry[0] if entry is not None else None
+
+    def get_similar(self, embedding, version, settings=None, namespace=None):
+        # Linear scan over the cached answers; the cache is small compared with the index
+        if not self.semantic_threshold or not self._check_version(version, namespace):
+            return None
+        now = time.monotonic()
+        with self.answers.lock:
+            candidates = [(key, entry[1][1]) for key, entry in self.answers.entries.items()
+                          if key[0] == namespace and key[2] == settings and entry[1][1] is not None
+                          and not (self.answers.ttl and now - entry[0] > self.answers.ttl)]
+        if not candidates:
+            return None
+        query = np.asarray(embedding, dtype=np.float32)
+        matrix = np.asarray([vector for _, vector in candidates], dtype=np.float32)
+        similarities = matrix @ query / (np.linalg.norm(matrix, axis=1) * np.linalg.norm(query) + 1e-12)
+        best = int(np.argmax(similarities))
+        if similarities[best] < self.semantic_threshold:
+            return None
+        entry = self.answers.get(candidates[best][0])
+        if entry is None:
+            return None
+        self.semantic_hits += 1
+        return entry[0]
+
+    def put(self, question, version, answer, embedding=None, settings=None, namespace=None):
+        if self._check_version(version, namespace):
+            self.answers.put((namespace, normalize(question), settings), (answer, embedding))
+
+    def stats(self):
+        return {
+            "versions": {str(namespace): version for namespace, version in self.versions.items()},
+            "query_embeddings": self.embeddings.stats(),
+            "answers": self.answers.stats(),
+            "semantic_threshold": self.semantic_threshold,
+            "semantic_hits": self.semantic_hits,
+        }
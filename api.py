@@ -1,26 +1,47 @@
 ## summary of the codebase below #
-## The api.py file sets up a Flask application with three main endpoints:
-# #1. /upload: Accepts file uploads (txt, docx, xlsx, pptx, pdf), processes the content, and stores it for later querying.
-# #2. /process_urls: Accepts a list of URLs, extracts text from the web pages, and adds the content to the document store.
+## The api.py file sets up a Flask application with the following endpoints:
+# #1. /upload: Accepts file uploads (txt, docx, xlsx, pptx, pdf, or formats added through parsers.py) and queues them; the content is processed and stored in the background.
+#    /upload_batch accepts many files in one request and commits them to the index as one job.
+#    A file whose content is already indexed under the same name is reported as "already indexed" and not parsed again.
+# #2. /process_urls: Accepts a list of URLs and queues a job that extracts text from the web pages and adds it to the document store.
 # #3 /ask: Takes a user question, retrieves relevant documents, and generates an answer using a language model, returning it as a JSON response.
+#    /ask_stream does the same but streams the sources and then the answer tokens as Server-Sent Events.
+#    /ask_batch answers a list of questions with one embedding call, one FAISS search and concurrent LLM calls.
+# #4 /delete: Removes every chunk of the given source (file name or URL) from the document store.
+# #5 /cache_stats: Reports hit/miss counts of the on-disk embedding cache.
+# #6 /jobs/<job_id>: Reports the status and progress of a queued upload or URL job.
+# #7 /parsers: Lists the registered document parsers, whether each is loaded, and how long its import took.
+# #8 /metrics: Prometheus metrics: per-stage and per-endpoint latency histograms, ingestion/cache/index counters and in-flight gauges.
+# #9 /collections: Lists the named collections, whether each is loaded, and their memory use.
+# Uploads, URLs, questions and deletes take an optional "collection" name; each collection has its own index shard and
+# chunk store, and the least recently used ones are paged out to their snapshots beyond COLLECTION_MEMORY_MB.
+# The prompt context is assembled within CONTEXT_MAX_TOKENS: overlapping chunks are merged and near-duplicates dropped.
+# Answers to repeated (or, optionally, near-identical) questions are served from a cache until the index changes.
+# Only new chunks are embedded; re-uploading a source replaces its previous chunks in the index.
+# The index and chunks are snapshotted to SNAPSHOT_DIR after each ingestion batch and memory-mapped back when used.
 #################
 
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify, stream_with_context
+import hashlib
+import importlib
+import json
 import os
-from io import BytesIO
-import numpy as np
-import faiss
-from bs4 import BeautifulSoup
-import requests
-from langchain.schema import Document
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_openai import AzureOpenAIEmbeddings, AzureChatOpenAI
-import pandas as pd
-from docx import Document as DocxDocument
-from pptx import Presentation
-import fitz  # PyMuPDF for PDF processing
+import time
+import tempfile
 from dotenv import load_dotenv
 import logging
+import backends
+from fake_llm import FakeChatModel
+from collection_manager import CollectionManager, DEFAULT_COLLECTION
+from jobs import IngestionQueue
+from url_fetcher import UrlFetcher, CHANGED, ERROR
+from ann_index import search_setting
+from chunking import chunk_segments
+from parsers import registry as parsers
+from answer_cache import AnswerCache
+from context_builder import ContextBuilder
+import metrics
+from metrics import Counter, Gauge, Histogram, TimedIterator, record, recording, span
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
@@ -29,48 +50,265 @@ logger = logging.getLogger(__name__)
 app = Flask(__name__)
 load_dotenv()
 
-# Load environment variables
-os.environ["AZURE_OPENAI_API_KEY"] = os.getenv("AZURE_OPENAI_API_KEY_GPT4")
+# LLM_BACKEND=fake answers with deterministic local text instead of calling Azure, e.g. for benchmark.py
+if os.getenv("LLM_BACKEND", "azure") == "fake":
+    llm = FakeChatModel(
+        first_token_latency=float(os.getenv("FAKE_LLM_FIRST_TOKEN_SECONDS", "0")),
+        token_latency=float(os.getenv("FAKE_LLM_TOKEN_SECONDS", "0")),
+    )
+else:
+    from langchain_openai import AzureChatOpenAI
+
+    # Load environment variables
+    os.environ["AZURE_OPENAI_API_KEY"] = os.getenv("AZURE_OPENAI_API_KEY_GPT4")
+
+    llm = AzureChatOpenAI(
+        openai_api_version=os.getenv("OPENAI_API_VERSION"),
+        azure_deployment=os.getenv("AZURE_DEPLOYMENT_GPT4"),
+        model_name=os.getenv("MODEL_NAME"),
+        azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT_GPT4"),
+        temperature=0.0,
+    )
+
+# Embeddings (Azure or EMBEDDING_BACKEND=fake) behind the batching client and the on-disk cache, and the vector
+# store settings; shared with bulk_index.py, see backends.py
+embeddings, embedding_client, embedding_cache = backends.embedding_backend()
+
 
-llm = AzureChatOpenAI(
-    openai_api_version=os.getenv("OPENAI_API_VERSION"),
-    azure_deployment=os.getenv("AZURE_DEPLOYMENT_GPT4"),
-    model_name=os.getenv("MODEL_NAME"),
-    azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT_GPT4"),
-    temperature=0.0,
+def make_store():
+    return backends.make_store(embeddings)
+
+# /ask caches: query embeddings, answers per index version and, with SEMANTIC_CACHE_THRESHOLD set, near-duplicate questions
+answer_cache = AnswerCache(
+    max_answers=int(os.getenv("ANSWER_CACHE_SIZE", "1000")),
+    answer_ttl=float(os.getenv("ANSWER_CACHE_TTL", "3600")),
+    max_embeddings=int(os.getenv("QUERY_EMBEDDING_CACHE_SIZE", "10000")),
+    embedding_ttl=float(os.getenv("QUERY_EMBEDDING_CACHE_TTL", "86400")),
+    semantic_threshold=float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0")) or None,
+)
+
+# Prompt context: CONTEXT_CANDIDATES chunks are retrieved, ordered by MMR (CONTEXT_MMR_LAMBDA), near-duplicates dropped
+# (CONTEXT_REDUNDANCY_THRESHOLD), overlapping chunks of a source merged, and added by relevance up to CONTEXT_MAX_TOKENS
+context_candidates = int(os.getenv("CONTEXT_CANDIDATES", "8"))
+context_builder = ContextBuilder(
+    max_tokens=int(os.getenv("CONTEXT_MAX_TOKENS", "1500")),
+    mmr_lambda=float(os.getenv("CONTEXT_MMR_LAMBDA", "0.7")),
+    redundancy_threshold=float(os.getenv("CONTEXT_REDUNDANCY_THRESHOLD", "0.95")),
+    token_counter=embedding_client.token_counter,
 )
 
-os.environ["AZURE_OPENAI_API_KEY"] = os.getenv("AZURE_OPENAI_API_KEY_EMBEDDING")
-os.environ["AZURE_OPENAI_ENDPOINT"] = os.getenv("AZURE_OPENAI_ENDPOINT_EMBEDDING")
-os.environ["AZURE_OPENAI_API_VERSION"] = os.getenv("AZURE_OPENAI_API_VERSION_EMBEDDING")
+# /ask_batch limits: questions per request and concurrent model calls per batch
+ask_batch_max_questions = int(os.getenv("ASK_BATCH_MAX_QUESTIONS", "500"))
+ask_batch_concurrency = int(os.getenv("ASK_BATCH_CONCURRENCY", "8"))
+
+# /upload_batch limit: files per request
+upload_batch_max_files = int(os.getenv("UPLOAD_BATCH_MAX_FILES", "200"))
+
+# Snapshot directory; set SNAPSHOT_DIR to an empty value to keep the corpus in memory only.
+# Every collection is snapshotted on its own, the default one directly in SNAPSHOT_DIR. Beyond COLLECTION_MEMORY_MB
+# (0 for no limit) the least recently used collections are paged out and reloaded from their snapshots on demand.
+snapshot_dir = os.getenv("SNAPSHOT_DIR", "snapshot")
+collections = CollectionManager(
+    make_store,
+    snapshot_dir=snapshot_dir or None,
+    memory_budget=int(os.getenv("COLLECTION_MEMORY_MB", "2048")) * 1024 * 1024,
+)
+# Store of the default collection, e.g. for benchmark.py
+store = collections.get(DEFAULT_COLLECTION).store
+collections.get(DEFAULT_COLLECTION).state()
+
+# Several API processes (e.g. gunicorn workers) can share SNAPSHOT_DIR: writes take turns through a lock file, each
+# on top of the latest snapshot, and every process reloads versions saved by the others within SNAPSHOT_POLL_SECONDS
+snapshot_poll_seconds = float(os.getenv("SNAPSHOT_POLL_SECONDS", "1"))
+last_snapshot_poll = 0.0
+
+
+@app.before_request
+def poll_snapshot():
+    global last_snapshot_poll
+    if snapshot_dir and time.monotonic() - last_snapshot_poll >= snapshot_poll_seconds:
+        last_snapshot_poll = time.monotonic()
+        collections.refresh()
+
+
+# PDFs with at least PDF_PARALLEL_PAGES pages are extracted by a pool of PDF_WORKERS processes
+parsers.configure("pdf", workers=int(os.getenv("PDF_WORKERS", "0")) or None,
+                  parallel_pages=int(os.getenv("PDF_PARALLEL_PAGES", "64")))
+
+# PARSER_PLUGINS: comma-separated modules imported at startup that add formats with parsers.registry.register()
+for plugin in filter(None, (name.strip() for name in os.getenv("PARSER_PLUGINS", "").split(","))):
+    importlib.import_module(plugin)
+
+# Uploads are spooled to UPLOAD_DIR and ingested by background parse/embed workers
+SUPPORTED_EXTENSIONS = parsers.extensions()
+upload_dir = os.getenv("UPLOAD_DIR") or None
+if upload_dir:
+    os.makedirs(upload_dir, exist_ok=True)
+ingestion = IngestionQueue(
+    store,
+    parse_workers=int(os.getenv("PARSE_WORKERS", "2")),
+    embed_workers=int(os.getenv("EMBED_WORKERS", "4")),
+    batch_size=int(os.getenv("EMBED_BATCH_SIZE", "256")),
+    commit_lock=collections.get(DEFAULT_COLLECTION),
+    # Job progress is written here so any worker process can answer /jobs/<job_id>
+    status_dir=os.getenv("JOB_STATUS_DIR", "job_status") or None,
+)
 
-embeddings = AzureOpenAIEmbeddings(
-    azure_deployment=os.getenv("AZURE_EMBEDDING_NAME"),
-    openai_api_version=os.getenv("AZURE_OPENAI_API_VERSION_EMBEDDING")
+# Concurrent URL fetching with pooled connections, per-host limits, timeouts and conditional re-fetch
+url_fetcher = UrlFetcher(
+    max_workers=int(os.getenv("URL_FETCH_WORKERS", "8")),
+    per_host=int(os.getenv("URL_FETCH_PER_HOST", "2")),
+    connect_timeout=float(os.getenv("URL_CONNECT_TIMEOUT", "5")),
+    read_timeout=float(os.getenv("URL_READ_TIMEOUT", "30")),
+    verify=os.getenv("URL_VERIFY_TLS", "false").lower() == "true",
+    validators_path=os.getenv("URL_VALIDATORS_FILE", "url_validators.json") or None,
 )
 
-documents = []
-faiss_index = None
+
+# Metrics served at /metrics; the per-stage histogram lives in metrics.py, the rest is read from the components
+request_seconds = Histogram("docstalk_request_seconds", "Request latency per endpoint.", ["endpoint"])
+requests_in_flight = Gauge("docstalk_requests_in_flight", "Requests being served per endpoint.", ["endpoint"])
+llm_first_token_seconds = Histogram("docstalk_llm_first_token_seconds", "Time from the /ask_stream request to the first answer token.")
+prompt_tokens = Histogram("docstalk_prompt_tokens", "Tokens per model prompt.",
+                          buckets=(100, 250, 500, 1000, 1500, 2000, 3000, 4000, 6000, 8000, 16000, 32000))
+context_tokens = Counter("docstalk_context_tokens_total", "Tokens of the retrieved chunks and of the context sent.", ["stage"])
+answers_total = Counter("docstalk_answers_total", "Answers served, by answer cache result (exact, semantic or miss).", ["cached"])
+Gauge("docstalk_index_chunks", "Chunks in the served index of each loaded collection.", ["collection"],
+      value_fn=lambda: {(collection.name,): len(collection.store) for collection in collections.resident()})
+Gauge("docstalk_index_version", "Version of the served index of each loaded collection.", ["collection"],
+      value_fn=lambda: {(collection.name,): collection.store.version for collection in collections.resident()})
+Gauge("docstalk_collection_memory_bytes", "Estimated memory of each loaded collection's index and chunks.", ["collection"],
+      value_fn=lambda: {(collection.name,): collection.memory_bytes() for collection in collections.resident()})
+Counter("docstalk_collection_loads_total", "Collections loaded from their snapshots, on first use or after paging out.",
+        value_fn=lambda: collections.loads)
+Counter("docstalk_collection_evictions_total", "Collections paged out to stay within COLLECTION_MEMORY_MB.",
+        value_fn=lambda: collections.evictions)
+Gauge("docstalk_resident_memory_bytes", "Resident memory of this process.", value_fn=metrics.resident_memory_bytes)
+Gauge("docstalk_ingestion_jobs_in_flight", "Ingestion jobs queued or running in this process.", value_fn=lambda: ingestion.in_flight())
+Counter("docstalk_embedding_tokens_total", "Tokens sent to the embedding model.", value_fn=lambda: embedding_client.stats()["tokens"])
+Counter("docstalk_embedding_requests_total", "Embedding requests, including retries.", value_fn=lambda: embedding_client.stats()["requests"])
+Counter("docstalk_embedding_retries_total", "Embedding requests retried after a rate limit or transient error.",
+        value_fn=lambda: embedding_client.stats()["retries"])
+Counter("docstalk_embedding_cache_lookups_total", "On-disk embedding cache lookups by result.", ["result"],
+        value_fn=lambda: {("hit",): embedding_cache.hits, ("miss",): embedding_cache.misses} if embedding_cache else {})
+Gauge("docstalk_parser_import_seconds", "Time the first use of each parser spent importing its backend.", ["parser"],
+      value_fn=lambda: {(name,): parser["import_seconds"] for name, parser in parsers.stats().items() if parser["loaded"]})
+
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+    g.request_endpoint = request.endpoint or "unknown"
+    requests_in_flight.inc(endpoint=g.request_endpoint)
+
+
+@app.teardown_request
+def stop_request_timer(error=None):
+    # For streamed responses this runs once the stream is finished
+    if "request_start" in g:
+        requests_in_flight.dec(endpoint=g.request_endpoint)
+        request_seconds.observe(time.perf_counter() - g.request_start, endpoint=g.request_endpoint)
+
+
+def parse_file(content, filename, mime_type=None):
+    # content is the document's bytes or a path to it; the registered parser streams text segments (pages, slides,
+    # paragraphs) into the chunker
+    logger.info(f"Processing file: {filename}")
+    segments = TimedIterator(parsers.segments(content, filename, mime_type))
+    start = time.perf_counter()
+    chunks = list(chunk_segments(segments, filename))
+    # Extraction and chunking interleave; the time spent waiting for segments counts as parsing
+    record("parse", segments.elapsed)
+    record("split", time.perf_counter() - start - segments.elapsed)
+    return chunks
+
+
+def fetch_urls(urls, validators, collection):
+    # Pages that are unchanged since they were indexed in the collection are skipped; validators of changed pages
+    # are collected so they can be remembered once the job is committed
+    docs_by_url = {}
+    errors = []
+    indexed = set(collection.state().sources())
+    with span("fetch"):
+        results = list(url_fetcher.fetch_all(urls, is_indexed=lambda url: url in indexed, collection=collection.name))
+    for result in results:
+        if result.status == CHANGED:
+            try:
+                docs_by_url[result.url] = parse_file(result.text.encode("utf-8"), result.url, mime_type="text/html")
+                validators[result.url] = result.validators
+            except Exception as e:
+                errors.append(f"Error processing URL '{result.url}': {str(e)}")
+        elif result.status == ERROR:
+            errors.append(result.error)
+    return docs_by_url, errors
+
+
+def spool_upload(file, extension):
+    # Saves an uploaded file to UPLOAD_DIR; returns its path and the SHA-256 of its content
+    digest = hashlib.sha256()
+    fd, path = tempfile.mkstemp(prefix="upload-", suffix=extension, dir=upload_dir)
+    with os.fdopen(fd, 'wb') as spool:
+        for block in iter(lambda: file.stream.read(1024 * 1024), b""):
+            digest.update(block)
+            spool.write(block)
+    return path, digest.hexdigest()
+
+
+def spooled_files_parser(files):
+    # Runs on a parse worker over [(path, filename, content hash)]; every spooled upload is removed once parsed.
+    # A file that cannot be parsed is reported and the others are still indexed.
+    def parse():
+        docs_by_source = {}
+        errors = []
+        for path, filename, content_hash in files:
+            try:
+                docs = parse_file(path, filename)
+                for doc in docs:
+                    doc.metadata["content_hash"] = content_hash
+                docs_by_source[filename] = docs
+            except Exception as e:
+                logger.exception(f"Error processing file {filename}.")
+                errors.append(f"Error processing file '{filename}': {str(e)}")
+            finally:
+                os.remove(path)
+        return docs_by_source, errors
+    return parse
+
+
+def request_collection(create=False):
+    # The collection named by the "collection" form field or JSON key, or the default one.
+    # Returns (collection, None), or (None, error response) for an invalid or unknown name.
+    name = request.form.get('collection') or (request.get_json(silent=True) or {}).get('collection') or DEFAULT_COLLECTION
+    try:
+        collection = collections.get(name, create=create)
+    except ValueError as e:
+        return None, (jsonify({"error": str(e)}), 400)
+    if collection is None:
+        return None, (jsonify({"error": f"Unknown collection: {name}"}), 404)
+    return collection, None
 
 
-def process_text(text, source, chunk_size=1000, chunk_overlap=200):
-    text_splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
-    chunks = text_splitter.split_text(text)
-    return [Document(page_content=chunk, metadata={"source": source}) for chunk in chunks]
+def request_search_settings():
+    # The optional per-request nprobe / ef_search as (settings, error response), like request_collection
+    try:
+        return (search_setting("nprobe", request.json.get('nprobe')),
+                search_setting("ef_search", request.json.get('ef_search'))), None
+    except ValueError as e:
+        return None, (jsonify({"error": str(e)}), 400)
 
 
-def process_pdf(content, filename, chunk_size=1000, chunk_overlap=200):
-    doc = fitz.open(stream=content, filetype="pdf")
-    concatenated_content = ""
-    for page in doc:
-        concatenated_content += page.get_text()
-    doc.close()
-    return process_text(concatenated_content, filename, chunk_size, chunk_overlap)
+def submit_job(collection, kind, description, parse, on_commit=None):
+    # The job's chunks go to the collection's store, which is snapshotted when they are committed
+    def commit():
+        collection.save()
+        if on_commit is not None:
+            on_commit()
+    return ingestion.submit(kind, description, parse, on_commit=commit, store=collection.store, commit_lock=collection,
+                            collection=collection.name)
 
 
 @app.route('/upload', methods=['POST'])
 def upload_file():
-    global documents, faiss_index
     logger.info("Received file upload request.")
 
     if 'file' not in request.files:
@@ -82,89 +320,222 @@ def upload_file():
         logger.error("No selected file.")
         return jsonify({"error": "No selected file"}), 400
 
-    try:
-        content = file.read()
-        file_extension = os.path.splitext(file.filename)[1].lower()
-
-        logger.info(f"Processing file: {file.filename} with extension: {file_extension}")
-
-        if file_extension == '.txt':
-            new_docs = process_text(content.decode('utf-8'), file.filename)
-        elif file_extension == '.docx':
-            doc = DocxDocument(BytesIO(content))
-            text = "\n".join([para.text for para in doc.paragraphs if para.text])
-            new_docs = process_text(text, file.filename)
-        elif file_extension == '.xlsx':
-            df = pd.read_excel(BytesIO(content))
-            text = df.to_string(index=False)
-            new_docs = process_text(text, file.filename)
-        elif file_extension == '.pptx':
-            prs = Presentation(BytesIO(content))
-            text = ""
-            for slide in prs.slides:
-                for shape in slide.shapes:
-                    if hasattr(shape, "text") and shape.text:
-                        text += shape.text + "\n"
-            new_docs = process_text(text, file.filename)
-        elif file_extension == '.pdf':
-            new_docs = process_pdf(content, file.filename)
-        else:
-            logger.error(f"Unsupported file type: {file_extension}")
-            return jsonify({"error": f"Unsupported file type: {file_extension}"}), 400
+    file_extension = os.path.splitext(file.filename)[1].lower()
+    if file_extension not in SUPPORTED_EXTENSIONS:
+        logger.error(f"Unsupported file type: {file_extension}")
+        return jsonify({"error": f"Unsupported file type: {file_extension}"}), 400
 
-        documents.extend(new_docs)
-        update_faiss_index()
-        logger.info(f"Successfully processed {file.filename}.")
-        return jsonify({"message": "File processed successfully"}), 200
+    collection, error = request_collection(create=True)
+    if error:
+        return error
+
+    try:
+        path, content_hash = spool_upload(file, file_extension)
+        if collection.state().chunks.hashes.get(file.filename) == content_hash:
+            os.remove(path)
+            logger.info(f"File {file.filename} is already indexed.")
+            return jsonify({"message": "File already indexed", "already_indexed": True, "content_hash": content_hash}), 200
+        job = submit_job(collection, "file", file.filename, spooled_files_parser([(path, file.filename, content_hash)]))
+        return jsonify({"message": "File queued for processing", "job_id": job.id, "content_hash": content_hash}), 202
 
     except Exception as e:
-        logger.exception("An error occurred while processing the file.")
+        logger.exception("An error occurred while queueing the file.")
         return jsonify({"error": "An error occurred while processing the file."}), 500
 
+
+@app.route('/upload_batch', methods=['POST'])
+def upload_batch():
+    # Many files as "files" parts of one multipart request. New or changed files are parsed, embedded and committed
+    # as one job; the response has a status per file: queued, already_indexed or error.
+    files = [file for file in request.files.getlist('files') if file.filename]
+    if not files:
+        logger.error("No files in the batch.")
+        return jsonify({"error": "No files provided"}), 400
+    if len(files) > upload_batch_max_files:
+        return jsonify({"error": f"At most {upload_batch_max_files} files per batch"}), 400
+    collection, error = request_collection(create=True)
+    if error:
+        return error
+
+    logger.info(f"Received batch of {len(files)} files.")
+    indexed = collection.state().chunks.hashes
+    results = []
+    spooled = []
+    names = set()
+    try:
+        for file in files:
+            extension = os.path.splitext(file.filename)[1].lower()
+            if extension not in SUPPORTED_EXTENSIONS:
+                results.append({"filename": file.filename, "status": "error", "error": f"Unsupported file type: {extension}"})
+                continue
+            if file.filename in names:
+                results.append({"filename": file.filename, "status": "error", "error": "Duplicate file name in batch"})
+                continue
+            names.add(file.filename)
+            path, content_hash = spool_upload(file, extension)
+            if indexed.get(file.filename) == content_hash:
+                os.remove(path)
+                results.append({"filename": file.filename, "status": "already_indexed", "content_hash": content_hash})
+                continue
+            spooled.append((path, file.filename, content_hash))
+            results.append({"filename": file.filename, "status": "queued", "content_hash": content_hash})
+    except Exception as e:
+        logger.exception("An error occurred while queueing the files.")
+        for path, _, _ in spooled:
+            os.remove(path)
+        return jsonify({"error": "An error occurred while processing the files."}), 500
+
+    job_id = None
+    if spooled:
+        job_id = submit_job(collection, "files", f"{len(spooled)} files", spooled_files_parser(spooled)).id
+    logger.info(f"Batch of {len(files)} files: {len(spooled)} queued, "
+                f"{sum(result['status'] == 'already_indexed' for result in results)} already indexed.")
+    return jsonify({"job_id": job_id, "files": results}), 202 if job_id else 200
+
 @app.route('/process_urls', methods=['POST'])
 def process_urls():
-    global documents, faiss_index
     urls = request.json.get('urls', [])
     errors = []
+    valid_urls = []
+    collection, error = request_collection(create=True)
+    if error:
+        return error
 
     for url in urls:
         if not url.startswith(('http://', 'https://')):
             errors.append(f"Invalid URL '{url}': No scheme supplied. Perhaps you meant 'https://{url}'?")
             continue
+        valid_urls.append(url)
 
-        try:
-            response = requests.get(url, verify=False)
-            if response.status_code == 200:
-                soup = BeautifulSoup(response.text, 'html.parser')
-                text_content = soup.get_text()
-                new_docs = process_text(text_content, url)
-                documents.extend(new_docs)
-            else:
-                errors.append(f"Error fetching URL '{url}': Status code {response.status_code}.")
-        except Exception as e:
-            errors.append(f"Error processing URL '{url}': {str(e)}")
-
-    update_faiss_index()
+    job_id = None
+    if valid_urls:
+        validators = {}
+        job_id = submit_job(collection, "urls", ", ".join(valid_urls), lambda: fetch_urls(valid_urls, validators, collection),
+                            on_commit=lambda: url_fetcher.remember(validators, collection.name)).id
 
     if errors:
-        return jsonify({"error": errors}), 400  # Return errors with 400 status code
+        return jsonify({"error": errors, "job_id": job_id}), 400  # Return errors with 400 status code
+
+    return jsonify({"message": "URLs queued for processing.", "job_id": job_id}), 202
+
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    job = ingestion.status(job_id)
+    if job is None:
+        return jsonify({"error": f"Unknown job: {job_id}"}), 404
+    return jsonify(job), 200
+
+
+@app.route('/delete', methods=['POST'])
+def delete_source():
+    source = request.json.get('source', '')
+    if not source:
+        logger.error("No source provided.")
+        return jsonify({"error": "No source provided"}), 400
+    collection, error = request_collection()
+    if error:
+        return error
+
+    with collection:
+        removed = collection.store.remove_source(source)
+        if removed:
+            collection.save()
+    if not removed:
+        return jsonify({"error": f"Unknown source: {source}"}), 404
+
+    logger.info(f"Deleted {removed} chunks of {source}.")
+    return jsonify({"message": f"Deleted {source}", "chunks_removed": removed}), 200
+
+
+@app.route('/cache_stats', methods=['GET'])
+def cache_stats():
+    if embedding_cache is None:
+        return jsonify({"enabled": False, "answer_cache": answer_cache.stats()}), 200
+    return jsonify({"enabled": True, **embedding_cache.stats(), "answer_cache": answer_cache.stats()}), 200
+
+
+def prepare_answer(question, collection, nprobe=None, ef_search=None):
+    # Everything /ask and /ask_stream do before calling the model: the answer cache, retrieval and the prompt.
+    # Only the collection's own index is searched, and its answers are cached apart from other collections'.
+    # nprobe/ef_search are optional per-request accuracy/latency knobs for approximate indexes; answers are cached per setting.
+    # The whole request reads one version of the index, even if an ingestion job swaps in a new one meanwhile.
+    # Stage timings of the request are collected in plan["timings"].
+    state = collection.state()
+    plan = {"question": question, "collection": collection.name, "settings": (nprobe, ef_search), "version": state.version,
+            "embedding": None, "sources": None, "prompt": question, "context": None, "cached": None, "cache_mode": None,
+            "timings": {}}
+    with recording(plan["timings"]):
+        plan = plan_answer(plan, state, nprobe, ef_search)
+    answers_total.inc(cached=plan["cache_mode"] or "miss")
+    return plan
+
+
+def plan_answer(plan, state, nprobe, ef_search):
+    question = plan["question"]
+    cached = answer_cache.get(question, plan["version"], plan["settings"], plan["collection"])
+    if cached is not None:
+        logger.info("Answer served from cache.")
+        plan.update(cached=cached, cache_mode="exact")
+        return plan
+
+    if not len(state):
+        logger.info("No documents uploaded, using LLM directly.")
+        return plan
+
+    with span("query_embed"):
+        plan["embedding"] = answer_cache.query_embedding(question, embeddings.embed_query)
+    cached = answer_cache.get_similar(plan["embedding"], plan["version"], plan["settings"], plan["collection"])
+    if cached is not None:
+        logger.info("Answer served from semantic cache.")
+        plan.update(cached=cached, cache_mode="semantic")
+        return plan
+
+    with span("search"):
+        docs, vectors = state.retrieve_many([plan["embedding"]], k=context_candidates, nprobe=nprobe, ef_search=ef_search)[0]
+    plan["prompt"], plan["sources"], plan["context"] = build_prompt(question, plan["embedding"], docs, vectors)
+    return plan
+
+
+def build_prompt(question, query_embedding, docs, vectors):
+    # Returns the prompt, the source of each context passage, and token counts of the context
+    with span("context"):
+        passages, stats = context_builder.build(query_embedding, docs, vectors)
+    context = "\n\n".join(passage.text for passage in passages)
+    sources = [passage.source for passage in passages]
+
+    prompt = (
+        "Greet the user as Hello!\n" 
+        "You are a knowledgeable assistant. Use the context below to answer the question accurately. If you do not find any context, please use your own data.\n"
+        "Apply your intelligence on the context provided below \n"
+        "Context:\n"
+        f"{context}\n\n"
+        f"Question: {question}\n"
+        "Answer:\n"
+        f"Sources: {', '.join(sources)}"
+    )
+    stats["prompt_tokens"] = context_builder.count(prompt)
+    prompt_tokens.observe(stats["prompt_tokens"])
+    context_tokens.inc(stats["retrieved_tokens"], stage="retrieved")
+    context_tokens.inc(stats["context_tokens"], stage="sent")
+    return prompt, sources, stats
 
-    return jsonify({"message": "URLs processed successfully."}), 200
 
+def remember_answer(plan, content):
+    answer = {"answer": content}
+    if plan["sources"] is not None:
+        answer["sources"] = plan["sources"]
+    answer_cache.put(plan["question"], plan["version"], answer, embedding=plan["embedding"], settings=plan["settings"],
+                     namespace=plan["collection"])
+    return answer
 
-def update_faiss_index():
-    global faiss_index
-    if documents:
-        embeddings_matrix = np.array(embeddings.embed_documents([doc.page_content for doc in documents]))
-        embedding_dimension = embeddings_matrix.shape[1]
-        faiss_index = faiss.IndexFlatL2(embedding_dimension)
-        faiss_index.add(embeddings_matrix)
-        logger.info("FAISS index updated.")
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
 
 
 @app.route('/ask', methods=['POST'])
 def ask_question():
-    global documents, faiss_index
     question = request.json.get('question', '')
 
     logger.info(f"Received question: {question}")
@@ -172,34 +543,183 @@ def ask_question():
     if not question:
         logger.error("No question provided.")
         return jsonify({"error": "No question provided"}), 400
+    collection, error = request_collection()
+    if error:
+        return error
+    settings, error = request_search_settings()
+    if error:
+        return error
+
+    start = time.perf_counter()
+    plan = prepare_answer(question, collection, *settings)
+    if plan["cached"] is not None:
+        answer = {**plan["cached"], "cached": plan["cache_mode"]}
+    else:
+        with span("llm", plan["timings"]):
+            response = llm.invoke(plan["prompt"])
+        logger.info("Question processed and answer generated.")
+        # Return both the answer and the sources
+        answer = remember_answer(plan, str(response.content))
+    # "timings": true in the request adds the per-stage breakdown of this request and the prompt's token counts
+    if request.json.get('timings'):
+        answer = {**answer, "timings": {**plan["timings"], "total_ms": round((time.perf_counter() - start) * 1000, 1)},
+                  "context": plan["context"]}
+    return jsonify(answer), 200
+
+
+@app.route('/ask_stream', methods=['POST'])
+def ask_question_stream():
+    # Server-Sent Events: "sources" first, then one "token" event per model chunk, then "done" with the timings
+    question = request.json.get('question', '')
 
-    if not documents:
-        logger.info("No documents uploaded, using LLM directly.")
-        response = llm.invoke(question)
-        return jsonify({"answer": str(response.content)}), 200
+    logger.info(f"Received streaming question: {question}")
 
-    question_embedding = embeddings.embed_query(question)
-    distances, indices = faiss_index.search(np.array([question_embedding]), k=5)
-    relevant_docs = [documents[i] for i in indices[0]]
+    if not question:
+        logger.error("No question provided.")
+        return jsonify({"error": "No question provided"}), 400
+    collection, error = request_collection()
+    if error:
+        return error
+    settings, error = request_search_settings()
+    if error:
+        return error
+
+    start = time.perf_counter()
+    plan = prepare_answer(question, collection, *settings)
+
+    def generate():
+        first_token = None
+        if plan["cached"] is not None:
+            yield sse_event("sources", plan["cached"].get("sources", []))
+            first_token = time.perf_counter()
+            yield sse_event("token", plan["cached"]["answer"])
+        else:
+            yield sse_event("sources", plan["sources"] or [])
+            parts = []
+            llm_start = time.perf_counter()
+            try:
+                for chunk in llm.stream(plan["prompt"]):
+                    if not chunk.content:
+                        continue
+                    if first_token is None:
+                        first_token = time.perf_counter()
+                        llm_first_token_seconds.observe(first_token - start)
+                    parts.append(chunk.content)
+                    yield sse_event("token", chunk.content)
+            except Exception as e:
+                logger.exception("An error occurred while streaming the answer.")
+                yield sse_event("error", str(e))
+                return
+            record("llm", time.perf_counter() - llm_start, plan["timings"])
+            remember_answer(plan, "".join(parts))
+        end = time.perf_counter()
+        timings = {
+            **plan["timings"],
+            "ttft_ms": round(((first_token or end) - start) * 1000, 1),
+            "total_ms": round((end - start) * 1000, 1),
+            "cached": plan["cache_mode"],
+            "prompt_tokens": plan["context"]["prompt_tokens"] if plan["context"] else None,
+        }
+        logger.info(f"Streamed answer: first token after {timings['ttft_ms']} ms, done after {timings['total_ms']} ms.")
+        yield sse_event("done", timings)
+
+    return Response(stream_with_context(generate()), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@app.route('/ask_batch', methods=['POST'])
+def ask_batch():
+    # Many questions at once: cached answers are served directly, the rest are embedded in one call, searched
+    # with one FAISS call and answered by up to ASK_BATCH_CONCURRENCY concurrent model calls
+    questions = request.json.get('questions', [])
+    if not isinstance(questions, list) or not questions or not all(isinstance(q, str) and q for q in questions):
+        logger.error("No questions provided.")
+        return jsonify({"error": "Provide a non-empty list of questions"}), 400
+    if len(questions) > ask_batch_max_questions:
+        return jsonify({"error": f"At most {ask_batch_max_questions} questions per batch"}), 400
+    collection, error = request_collection()
+    if error:
+        return error
+    settings, error = request_search_settings()
+    if error:
+        return error
+
+    logger.info(f"Received batch of {len(questions)} questions.")
+    nprobe, ef_search = settings
+    namespace = collection.name
+    state = collection.state()
+    version = state.version
+    timings = {}
+    results = [None] * len(questions)
+    start = time.perf_counter()
+
+    with span("answer_cache", timings):
+        for i, question in enumerate(questions):
+            cached = answer_cache.get(question, version, settings, namespace)
+            if cached is not None:
+                results[i] = {**cached, "cached": "exact"}
+    pending = [i for i, result in enumerate(results) if result is None]
+
+    plans = {}
+    if pending and len(state):
+        with span("query_embed", timings):
+            query_embeddings = answer_cache.query_embeddings([questions[i] for i in pending], embeddings.embed_queries)
+
+        for i, embedding in zip(pending, query_embeddings):
+            cached = answer_cache.get_similar(embedding, version, settings, namespace)
+            if cached is not None:
+                results[i] = {**cached, "cached": "semantic"}
+            else:
+                plans[i] = {"question": questions[i], "collection": namespace, "settings": settings, "version": version,
+                            "embedding": embedding}
+
+        with span("search", timings):
+            searched = list(plans)
+            retrieved = state.retrieve_many([plans[i]["embedding"] for i in searched], k=context_candidates, nprobe=nprobe,
+                                            ef_search=ef_search) if searched else []
+        with recording(timings):
+            for i, (docs, vectors) in zip(searched, retrieved):
+                plans[i]["prompt"], plans[i]["sources"], plans[i]["context"] = build_prompt(
+                    questions[i], plans[i]["embedding"], docs, vectors)
+    else:
+        for i in pending:
+            plans[i] = {"question": questions[i], "collection": namespace, "settings": settings, "version": version,
+                        "embedding": None, "prompt": questions[i], "sources": None}
+
+    if plans:
+        order = list(plans)
+        with span("llm", timings):
+            responses = llm.batch([plans[i]["prompt"] for i in order], config={"max_concurrency": ask_batch_concurrency},
+                                  return_exceptions=True)
+        for i, response in zip(order, responses):
+            if isinstance(response, Exception):
+                logger.error(f"Batch question {i} failed: {response}")
+                results[i] = {"error": str(response)}
+            else:
+                results[i] = remember_answer(plans[i], str(response.content))
 
-    context = " ".join([doc.page_content for doc in relevant_docs])
-    sources = [doc.metadata["source"] for doc in relevant_docs]
+    for result in results:
+        answers_total.inc(cached=result.get("cached") or "miss")
+    timings["total_ms"] = round((time.perf_counter() - start) * 1000, 1)
+    batch_prompt_tokens = sum(plan["context"]["prompt_tokens"] for plan in plans.values() if plan.get("context"))
+    logger.info(f"Answered batch of {len(questions)} questions ({len(questions) - len(plans)} from cache) in {timings['total_ms']} ms.")
+    return jsonify({"results": [{"question": q, **r} for q, r in zip(questions, results)], "timings": timings,
+                    "prompt_tokens": batch_prompt_tokens}), 200
+
+
+@app.route('/parsers', methods=['GET'])
+def parser_stats():
+    return jsonify(parsers.stats()), 200
+
+
+@app.route('/collections', methods=['GET'])
+def list_collections():
+    return jsonify(collections.stats()), 200
 
-    prompt = (
-        "Greet the user as Hello!\n" 
-        "You are a knowledgeable assistant. Use the context below to answer the question accurately. If you do not find any context, please use your own data.\n"
-        "Apply your intelligence on the context provided below \n"
-        "Context:\n"
-        f"{context}\n\n"
-        f"Question: {question}\n"
-        "Answer:\n"
-        f"Sources: {', '.join(sources)}"
-    )
 
-    response = llm.invoke(prompt)
-    logger.info("Question processed and answer generated.")
-    # Return both the answer and the sources
-    return jsonify({"answer": str(response.content), "sources": sources}), 200
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
 
 
 if __name__ == '__main__':
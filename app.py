@@ -2,14 +2,61 @@
 #1. This file implements a Streamlit application called "DocsTalk," which allows users to upload documents, process URLs, and ask questions about the content.
 #2. The app interacts with a backend API (api.py) to handle file uploads, extract text from provided URLs, and retrieve answers based on user queries.
 #3. It features a simple user interface with clear instructions and feedback for a seamless experience.
+#4. Documents go to the collection named at the top, and questions are answered from that collection only.
+#5. New files are sent together in one /upload_batch request. Files indexed in this session are remembered by
+#   content hash, so the reruns Streamlit does on every interaction do not upload them again; failed ones are retried.
 #################################
+import hashlib
+import json
+import time
 import streamlit as st
 import requests
-from io import BytesIO
 
 # Initialize session state variable to track document uploads
 if 'documents_uploaded' not in st.session_state:
     st.session_state['documents_uploaded'] = False
+# (collection, file name, content hash) of every file the API has indexed -> "done" or "already_indexed";
+# files that failed are left out, so they are sent again on the next rerun
+if 'ingested_files' not in st.session_state:
+    st.session_state['ingested_files'] = {}
+
+
+def wait_for_job(job_id, label):
+    # Uploads and URLs are ingested in the background; poll the job until it is committed to the index
+    progress = st.progress(0.0, text=f"{label}: queued")
+    while True:
+        job = requests.get(f'http://localhost:5000/jobs/{job_id}').json()
+        total = job['chunks_total']
+        progress.progress(job['chunks_embedded'] / total if total else 0.0,
+                          text=f"{label}: {job['status']} ({job['chunks_embedded']}/{total} chunks)")
+        if job['status'] in ('done', 'failed'):
+            progress.empty()
+            return job
+        time.sleep(0.5)
+
+
+def stream_events(url, payload):
+    # Minimal Server-Sent Events reader yielding (event, data) pairs; data is JSON-encoded by the API.
+    # An error response (e.g. an unknown collection) comes back as a single "error" event with the API's message,
+    # read here because the body is gone once the with block closes the response.
+    with requests.post(url, json=payload, stream=True) as response:
+        if not response.ok:
+            try:
+                message = response.json().get('error')
+            except ValueError:
+                message = None
+            yield 'error', message or f"Error getting answer ({response.status_code})."
+            return
+        event, data = None, []
+        for line in response.iter_lines(decode_unicode=True):
+            if line.startswith('event:'):
+                event = line[6:].strip()
+            elif line.startswith('data:'):
+                data.append(line[5:].strip())
+            elif not line and event:
+                yield event, json.loads("\n".join(data))
+                event, data = None, []
+
 
 # Streamlit UI
 st.title("DocsTalk: Talk to your documents")
@@ -34,21 +81,42 @@ st.markdown("""
     <strong>Upload Documents</strong> ➡️ <strong>Process URLs if you need to</strong> ➡️ <strong>Ask Questions to Language Model</strong>
 """, unsafe_allow_html=True)
 
+# Each collection has its own index on the API; uploads, URLs and questions below use this one
+collection = st.text_input("Collection", value="default",
+                           help="Letters, digits, '-' and '_'. Questions only search the documents of this collection.")
+
 # File upload section
 st.header("Upload Documents")
 uploaded_files = st.file_uploader("Choose files", accept_multiple_files=True, type=['txt', 'docx', 'xlsx', 'pptx', 'pdf'])
 
 if uploaded_files:
+    st.session_state['documents_uploaded'] = True  # Set state to true when documents are uploaded
+    ingested = st.session_state['ingested_files']
+    # Only files not sent before in this session; the API also skips files it has already indexed
+    new_files = {}
     for file in uploaded_files:
-        st.session_state['documents_uploaded'] = True  # Set state to true when documents are uploaded
-        file_content = BytesIO(file.read())
-        files = {'file': (file.name, file_content, file.type)}
-        response = requests.post('http://localhost:5000/upload', files=files)
-        if response.status_code == 200:
-            st.success(f"File {file.name} uploaded and processed successfully!")
+        key = (collection, file.name, hashlib.sha256(file.getvalue()).hexdigest())
+        if key not in ingested:
+            new_files[key] = file
+    if new_files:
+        files = [('files', (file.name, file.getvalue(), file.type)) for file in new_files.values()]
+        response = requests.post('http://localhost:5000/upload_batch', files=files, data={'collection': collection})
+        if response.status_code in (200, 202):
+            body = response.json()
+            job = wait_for_job(body['job_id'], f"{len(new_files)} files") if body['job_id'] else None
+            for (key, file), result in zip(new_files.items(), body['files']):
+                if result['status'] == 'already_indexed':
+                    ingested[key] = 'already_indexed'
+                    st.info(f"File {file.name} is already indexed.")
+                elif result['status'] == 'queued' and job['status'] == 'done' and file.name in job['sources']:
+                    ingested[key] = 'done'
+                    st.success(f"File {file.name} uploaded and processed successfully!")
+                else:
+                    errors = [result['error']] if 'error' in result else [e for e in job['errors'] if file.name in e] or job['errors']
+                    st.error(f"Error processing file {file.name}: {'; '.join(errors)}")
         else:
-            error_message = response.json().get('error', 'Error uploading file.')
-            st.error(f"Error uploading file {file.name}: {error_message}")
+            error_message = response.json().get('error', 'Error uploading files.')
+            st.error(f"Error uploading files: {error_message}")
 
 # URL input section
 st.header("Add URLs")
@@ -62,13 +130,18 @@ if st.button("Process URLs"):
         st.warning("Please enter a maximum of 5 URLs.")
     elif urls:
         st.session_state['documents_uploaded'] = True  # Set state to true when URLs are uploaded
-        response = requests.post('http://localhost:5000/process_urls', json={'urls': urls})
+        response = requests.post('http://localhost:5000/process_urls', json={'urls': urls, 'collection': collection})
+        errors = response.json().get('error', []) if response.status_code != 202 else []
+        if isinstance(errors, str):
+            errors = [errors]
+        job_id = response.json().get('job_id')
+        if job_id:
+            errors += wait_for_job(job_id, "URLs")['errors']
 
-        if response.status_code == 200:
+        if not errors:
             st.success("All URLs processed successfully!")
         else:
-            error_message = response.json().get('error', 'Error processing URLs.')
-            for error in error_message:
+            for error in errors:
                 st.error(error)
     else:
         st.warning("Please enter at least one URL.")
@@ -80,18 +153,29 @@ if st.button("Get Answer"):
     if question:
         if not st.session_state['documents_uploaded']:
             st.info("Note: Since no documents are uploaded, the response will be generated without any custom context.")
-        response = requests.post('http://localhost:5000/ask', json={'question': question})
-        if response.status_code == 200:
-            answer = response.json()['answer']
-            sources = response.json().get('sources', [])  # Get the sources from the response
-            st.write("Answer:", answer)
-            if sources:
-                st.write("Sources:")
-                for source in sources:
-                    st.write(f"- {source}")  # Display each source
-        else:
-            error_message = response.json().get('error', 'Error getting answer.')
-            st.error(error_message)
+        # Tokens are rendered as the API streams them; sources arrive before the first token
+        answer_box = st.empty()
+        sources_box = st.container()
+        answer = ""
+        timings = None
+        try:
+            for event, data in stream_events('http://localhost:5000/ask_stream', {'question': question, 'collection': collection}):
+                if event == 'sources' and data:
+                    sources_box.write("Sources:")
+                    for source in data:
+                        sources_box.write(f"- {source}")  # Display each source
+                elif event == 'token':
+                    answer += data
+                    answer_box.markdown(f"**Answer:** {answer}")
+                elif event == 'done':
+                    timings = data
+                elif event == 'error':
+                    st.error(data)
+        except requests.RequestException as e:
+            st.error(f"Error getting answer: {e}")
+        if timings:
+            st.caption(f"First token after {timings['ttft_ms']:.0f} ms, complete after {timings['total_ms']:.0f} ms"
+                       + (f" ({timings['cached']} cache hit)" if timings['cached'] else ""))
     else:
         st.warning("Please enter a question.")
 
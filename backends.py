@@ -0,0 +1,72 @@
+## summary of the code below ##
+## Builds the embedding stack and vector stores from environment variables (see "Optional settings" in the README),
+## so the API (api.py), the single-process app (integrated.py) and the offline bulk indexer (bulk_index.py) embed and
+## index chunks the same way, and api.py and bulk_index.py write snapshots either of them can load.
+#################
+
+import os
+
+from embedding_cache import CachedEmbeddings, EmbeddingCache
+from embedding_client import BatchedEmbeddings
+from fake_embeddings import FakeEmbeddings
+from vector_store import VectorStore
+
+
+def embedding_backend():
+    # Returns (embeddings, batched client, on-disk cache or None); embeddings is what stores and queries use
+    # EMBEDDING_BACKEND=fake swaps Azure for deterministic local vectors, e.g. to test ingestion offline
+    max_batch_size = int(os.getenv("EMBED_MAX_BATCH_SIZE", "2048"))
+    if os.getenv("EMBEDDING_BACKEND", "azure") == "fake":
+        embedding_model = "fake"
+        embeddings = FakeEmbeddings(dimension=int(os.getenv("FAKE_EMBEDDING_DIM", "1536")),
+                                    latency=float(os.getenv("FAKE_EMBEDDING_SECONDS", "0")), per_input_latency=0.0)
+    else:
+        from langchain_openai import AzureOpenAIEmbeddings
+
+        os.environ["AZURE_OPENAI_API_KEY"] = os.getenv("AZURE_OPENAI_API_KEY_EMBEDDING")
+        os.environ["AZURE_OPENAI_ENDPOINT"] = os.getenv("AZURE_OPENAI_ENDPOINT_EMBEDDING")
+        os.environ["AZURE_OPENAI_API_VERSION"] = os.getenv("AZURE_OPENAI_API_VERSION_EMBEDDING")
+        embedding_model = os.getenv("AZURE_EMBEDDING_NAME")
+        # Retries and batching are left to the dispatcher below
+        embeddings = AzureOpenAIEmbeddings(
+            azure_deployment=os.getenv("AZURE_EMBEDDING_NAME"),
+            openai_api_version=os.getenv("AZURE_OPENAI_API_VERSION_EMBEDDING"),
+            chunk_size=max_batch_size,
+            max_retries=0,
+        )
+
+    # Chunks are packed into requests by token count and sent EMBED_CONCURRENCY at a time, with backoff on 429s
+    embeddings = embedding_client = BatchedEmbeddings(
+        embeddings,
+        max_batch_tokens=int(os.getenv("EMBED_MAX_BATCH_TOKENS", "50000")),
+        max_batch_size=max_batch_size,
+        max_concurrency=int(os.getenv("EMBED_CONCURRENCY", "4")),
+        max_retries=int(os.getenv("EMBED_MAX_RETRIES", "6")),
+    )
+
+    # On-disk embedding cache keyed by chunk text and deployment; set EMBEDDING_CACHE_DIR to an empty value to disable it
+    embedding_cache = None
+    if os.getenv("EMBEDDING_CACHE_DIR", "embedding_cache"):
+        embedding_cache = EmbeddingCache(
+            os.getenv("EMBEDDING_CACHE_DIR", "embedding_cache"),
+            embedding_model,
+            max_bytes=int(os.getenv("EMBEDDING_CACHE_MAX_MB", "1024")) * 1024 * 1024,
+        )
+        embeddings = CachedEmbeddings(embeddings, embedding_cache)
+    return embeddings, embedding_client, embedding_cache
+
+
+def make_store(embeddings):
+    # Index type: flat, ivf, hnsw, or auto (flat until ANN_THRESHOLD chunks, then AUTO_INDEX_TYPE)
+    # Vector storage: full, fp16, sq8 or pq; compressed codes are re-ranked exactly from a memory-mapped vector file
+    return VectorStore(
+        embeddings,
+        index_type=os.getenv("FAISS_INDEX_TYPE", "auto"),
+        ann_threshold=int(os.getenv("ANN_THRESHOLD", "50000")),
+        auto_index_type=os.getenv("AUTO_INDEX_TYPE", "ivf"),
+        nprobe=int(os.getenv("FAISS_NPROBE", "16")),
+        ef_search=int(os.getenv("FAISS_EF_SEARCH", "64")),
+        storage=os.getenv("VECTOR_STORAGE", "full"),
+        rerank_factor=int(os.getenv("RERANK_FACTOR", "4")),
+        vector_dir=os.getenv("VECTOR_DIR") or None,
+    )
@@ -0,0 +1,303 @@
+## summary of the code below ##
+## Offline benchmark of the ingestion and query paths of api.py. Azure is replaced by the deterministic fakes in
+## fake_embeddings.py and fake_llm.py, and the snapshot, embedding and answer caches are turned off, so runs cost
+## nothing and measure DocsTalk's own code. Measured:
+##   parse     per-format parse throughput on generated txt/docx/xlsx/pptx/pdf fixtures, and each parser's import time
+##             (in a fresh interpreter, since generating the fixtures imports the same libraries)
+##   ingest    /upload of each fixture until its job is committed
+##   chunking  splitter throughput on plain text, whole-document and streamed
+##   scale     index build time, one incremental append, search latency and /ask p50/p95/p99 at each corpus size
+## Results go to a JSON file (with the git commit and settings) so runs can be compared over time.
+## Example:
+##   python benchmark.py --sizes 1000 100000 1000000 --dim 384 --json bench_output.json
+#################
+
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+from io import BytesIO
+
+import numpy as np
+
+_WORDS = ("revenue", "quarter", "customer", "product", "growth", "margin", "report", "market", "team", "strategy",
+          "the", "of", "and", "to", "in", "for", "with", "on", "by", "our", "was", "increased", "during", "new")
+
+
+def configure_environment(args):
+    # Must run before api.py is imported, since it reads its settings at import time
+    os.environ.update({
+        "EMBEDDING_BACKEND": "fake",
+        "LLM_BACKEND": "fake",
+        "FAKE_EMBEDDING_DIM": str(args.dim),
+        "FAKE_LLM_FIRST_TOKEN_SECONDS": str(args.llm_latency),
+        "EMBEDDING_CACHE_DIR": "",
+        "SNAPSHOT_DIR": "",
+        "URL_VALIDATORS_FILE": "",
+        "JOB_STATUS_DIR": "",
+        "ANSWER_CACHE_SIZE": "0",
+        "QUERY_EMBEDDING_CACHE_SIZE": "0",
+        "FAISS_INDEX_TYPE": args.index_type,
+        "VECTOR_STORAGE": args.storage,
+    })
+
+
+def sentences(rng, count, words=12):
+    return [" ".join(rng.choice(_WORDS) for _ in range(words)).capitalize() + "." for _ in range(count)]
+
+
+def make_fixtures(rng, pages):
+    # Roughly the same amount of text per format: pages * 30 sentences
+    import fitz
+    import pandas as pd
+    from docx import Document as DocxDocument
+    from pptx import Presentation
+    from pptx.util import Inches
+
+    paragraphs = [" ".join(sentences(rng, 30)) for _ in range(pages)]
+    fixtures = {".txt": "\n\n".join(paragraphs).encode("utf-8")}
+
+    doc = DocxDocument()
+    for paragraph in paragraphs:
+        doc.add_paragraph(paragraph)
+    buffer = BytesIO()
+    doc.save(buffer)
+    fixtures[".docx"] = buffer.getvalue()
+
+    rows = [sentence for paragraph in paragraphs for sentence in paragraph.split(". ")]
+    buffer = BytesIO()
+    pd.DataFrame({"id": range(len(rows)), "text": rows, "value": [rng.random() for _ in rows]}).to_excel(buffer, index=False)
+    fixtures[".xlsx"] = buffer.getvalue()
+
+    prs = Presentation()
+    for paragraph in paragraphs:
+        slide = prs.slides.add_slide(prs.slide_layouts[5])
+        slide.shapes.add_textbox(Inches(0.5), Inches(1.5), Inches(9), Inches(5)).text_frame.text = paragraph
+    buffer = BytesIO()
+    prs.save(buffer)
+    fixtures[".pptx"] = buffer.getvalue()
+
+    pdf = fitz.open()
+    for paragraph in paragraphs:
+        pdf.new_page().insert_textbox(fitz.Rect(72, 72, 540, 770), paragraph, fontsize=9)
+    fixtures[".pdf"] = pdf.tobytes()
+    pdf.close()
+    return fixtures
+
+
+def percentiles(latencies):
+    latencies = np.asarray(latencies) * 1000
+    return {
+        "p50_ms": round(float(np.percentile(latencies, 50)), 3),
+        "p95_ms": round(float(np.percentile(latencies, 95)), 3),
+        "p99_ms": round(float(np.percentile(latencies, 99)), 3),
+        "mean_ms": round(float(latencies.mean()), 3),
+    }
+
+
+def best_of(repeat, fn):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+
+def bench_parse(api, fixtures, repeat):
+    rows = []
+    for ext, content in fixtures.items():
+        seconds, chunks = best_of(repeat, lambda: api.parse_file(content, f"bench{ext}"))
+        rows.append({
+            "format": ext[1:],
+            "bytes": len(content),
+            "chunks": len(chunks),
+            "seconds": round(seconds, 4),
+            "mb_per_s": round(len(content) / seconds / 1e6, 3),
+            "chunks_per_s": round(len(chunks) / seconds, 1),
+        })
+    return rows
+
+
+def bench_parser_imports(names):
+    # Each parser's one-off import cost, measured in a fresh interpreter per parser: in this process the fixture
+    # generators have already imported the same backends. None for parsers whose backend is not installed.
+    script = "import sys; from parsers import registry; parser = registry.parsers[sys.argv[1]]; parser.load(); " \
+             "print(parser.import_seconds)"
+    seconds = {}
+    for name in names:
+        try:
+            output = subprocess.check_output([sys.executable, "-c", script, name], text=True, stderr=subprocess.DEVNULL,
+                                             cwd=os.path.dirname(os.path.abspath(__file__)))
+            seconds[name] = float(output.strip().splitlines()[-1])
+        except (OSError, subprocess.CalledProcessError, ValueError, IndexError):
+            seconds[name] = None
+    return seconds
+
+
+def bench_ingest(api, fixtures):
+    client = api.app.test_client()
+    rows = []
+    for ext, content in fixtures.items():
+        start = time.perf_counter()
+        response = client.post("/upload", data={"file": (BytesIO(content), f"ingest{ext}")}, content_type="multipart/form-data")
+        job_id = response.get_json()["job_id"]
+        while api.ingestion.status(job_id)["status"] not in ("done", "failed"):
+            time.sleep(0.005)
+        status = api.ingestion.status(job_id)
+        rows.append({"format": ext[1:], "status": status["status"], "chunks": status["chunks_total"],
+                     "seconds": round(time.perf_counter() - start, 4)})
+    return rows
+
+
+def bench_chunking(rng, chars, repeat):
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+    from chunking import chunk_segments
+
+    text = " ".join(sentences(rng, chars // 80))
+    splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
+    whole, chunks = best_of(repeat, lambda: splitter.split_text(text))
+    segments = [(text[i:i + 4000], {"page": i // 4000 + 1}) for i in range(0, len(text), 4000)]
+    streamed, streamed_chunks = best_of(repeat, lambda: list(chunk_segments(iter(segments), "bench")))
+    return {
+        "chars": len(text),
+        "whole": {"chunks": len(chunks), "seconds": round(whole, 4), "mchars_per_s": round(len(text) / whole / 1e6, 3)},
+        "streamed": {"chunks": len(streamed_chunks), "seconds": round(streamed, 4),
+                     "mchars_per_s": round(len(text) / streamed / 1e6, 3)},
+    }
+
+
+def synthetic_corpus(rng, size, dim, seed):
+    from langchain.schema import Document
+
+    np_rng = np.random.default_rng(seed)
+    # Clustered data is closer to real embeddings than uniform noise
+    centers = np_rng.standard_normal((max(1, size // 100), dim)).astype(np.float32)
+    vectors = centers[np_rng.integers(0, len(centers), size)] + 0.3 * np_rng.standard_normal((size, dim)).astype(np.float32)
+    texts = sentences(rng, 256, words=30)
+    docs = [Document(page_content=texts[i % len(texts)], metadata={"source": f"doc{i // 1000}.txt"}) for i in range(size)]
+    return docs, vectors
+
+
+def bench_scale(api, rng, size, args):
+    from chunk_store import ChunkStore
+
+    docs, vectors = synthetic_corpus(rng, size, args.dim, args.seed)
+    api.store.swap(None, ChunkStore(), None)
+    start = time.perf_counter()
+    api.store.append(docs, vectors)
+    build = time.perf_counter() - start
+
+    extra_docs, extra_vectors = synthetic_corpus(rng, 1000, args.dim, args.seed + 1)
+    start = time.perf_counter()
+    api.store.append([type(doc)(page_content=doc.page_content, metadata={"source": "extra.txt"}) for doc in extra_docs], extra_vectors)
+    append = time.perf_counter() - start
+
+    queries = vectors[np.random.default_rng(args.seed).integers(0, size, args.queries)]
+    search_latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        api.store.search(query, k=5)
+        search_latencies.append(time.perf_counter() - start)
+
+    client = api.app.test_client()
+    questions = sentences(rng, args.queries, words=8)
+    for question in questions[:min(10, len(questions))]:
+        client.post("/ask", json={"question": question})
+    ask_latencies = []
+    for question in questions:
+        start = time.perf_counter()
+        response = client.post("/ask", json={"question": question})
+        ask_latencies.append(time.perf_counter() - start)
+        assert response.status_code == 200, response.get_json()
+    return {
+        "chunks": size,
+        "index": api.store.target_kind(size),
+        "build_seconds": round(build, 3),
+        "append_1k_seconds": round(append, 4),
+        "search": percentiles(search_latencies),
+        "ask": percentiles(ask_latencies),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark DocsTalk ingestion and queries offline with fake model backends.")
+    parser.add_argument("--sizes", type=int, nargs="*", default=[1000, 100000, 1000000], help="corpus sizes in chunks")
+    parser.add_argument("--dim", type=int, default=384, help="embedding dimension (1536 for production-sized vectors)")
+    parser.add_argument("--queries", type=int, default=200, help="/ask requests per corpus size")
+    parser.add_argument("--pages", type=int, default=50, help="pages (or paragraphs, rows, slides) per fixture")
+    parser.add_argument("--chunking-chars", type=int, default=5000000)
+    parser.add_argument("--repeat", type=int, default=3, help="parse/chunking runs; the fastest is reported")
+    parser.add_argument("--index-type", default="auto")
+    parser.add_argument("--storage", default="full")
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="seconds the fake model waits before answering")
+    parser.add_argument("--skip", nargs="*", default=[], choices=["parse", "ingest", "chunking", "scale"])
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="write the results to this file")
+    args = parser.parse_args()
+
+    configure_environment(args)
+    import logging
+    import api
+    logging.getLogger().setLevel(logging.WARNING)
+
+    rng = random.Random(args.seed)
+    results = {
+        "run": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "git_commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "settings": vars(args),
+        },
+    }
+
+    fixtures = None
+    if "parse" not in args.skip or "ingest" not in args.skip:
+        fixtures = make_fixtures(rng, args.pages)
+    if "parse" not in args.skip:
+        results["parse"] = bench_parse(api, fixtures, args.repeat)
+        for row in results["parse"]:
+            print(f"parse {row['format']:<5} {row['bytes'] / 1e6:8.2f} MB {row['chunks']:6} chunks "
+                  f"{row['seconds']:8.4f} s {row['mb_per_s']:8.2f} MB/s {row['chunks_per_s']:10.1f} chunks/s")
+        results["parser_imports"] = bench_parser_imports(api.parsers.stats())
+        for name, seconds in results["parser_imports"].items():
+            print(f"import {name:<5} " + ("not installed" if seconds is None else f"{seconds * 1000:8.1f} ms"))
+    if "ingest" not in args.skip:
+        results["ingest"] = bench_ingest(api, fixtures)
+        for row in results["ingest"]:
+            print(f"ingest {row['format']:<5} {row['chunks']:6} chunks {row['seconds']:8.4f} s ({row['status']})")
+    if "chunking" not in args.skip:
+        results["chunking"] = bench_chunking(rng, args.chunking_chars, args.repeat)
+        for mode in ("whole", "streamed"):
+            row = results["chunking"][mode]
+            print(f"chunking {mode:<8} {row['chunks']:7} chunks {row['seconds']:8.4f} s {row['mchars_per_s']:8.2f} Mchars/s")
+    if "scale" not in args.skip:
+        results["scale"] = []
+        for size in args.sizes:
+            row = bench_scale(api, rng, size, args)
+            results["scale"].append(row)
+            print(f"scale {size:>8} chunks {row['index']:<5} build {row['build_seconds']:8.3f} s "
+                  f"append 1k {row['append_1k_seconds']:7.4f} s search p50 {row['search']['p50_ms']:8.3f} ms "
+                  f"ask p50/p95/p99 {row['ask']['p50_ms']:.2f}/{row['ask']['p95_ms']:.2f}/{row['ask']['p99_ms']:.2f} ms")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,269 @@
+## summary of the code below ##
+## Offline bulk indexer: builds the snapshot api.py serves as a batch job, without going through HTTP uploads.
+## Walks the given files and directories for every format parsers.py supports, parses and chunks the files in a
+## process pool, embeds the chunks with the same batched (and cached) embedding client as the API, and commits them
+## to a collection's snapshot every --commit-chunks chunks. Commits go through SnapshotWriter, so a running API picks
+## the new versions up within SNAPSHOT_POLL_SECONDS and a restarted one loads them at startup.
+## Re-runs are incremental: bulk_index.json in the collection's snapshot directory keeps the size, mtime and SHA-256
+## of every file indexed. Files whose size and mtime are unchanged are not read; files with a new mtime are hashed and
+## only re-indexed if their content changed; files that disappeared from the given directories are removed.
+## Sources are the file paths relative to the working directory.
+## Example:
+##   python bulk_index.py docs/ reports/ --snapshot snapshot --collection reports --workers 8 --json bulk_index_report.json
+#################
+
+import argparse
+import hashlib
+import importlib
+import json
+import logging
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from dotenv import load_dotenv
+
+import backends
+from chunking import chunk_segments
+from collection_manager import CollectionManager, DEFAULT_COLLECTION
+from parsers import registry as parsers
+
+logger = logging.getLogger(__name__)
+
+# Per-collection record of the indexed files, next to the snapshot versions
+MANIFEST = "bulk_index.json"
+
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def source_name(path):
+    return os.path.relpath(path).replace(os.sep, "/")
+
+
+def find_files(paths):
+    # {source: path} of every supported file under the given files and directories; hidden ones are skipped
+    found = {}
+    for path in paths:
+        if os.path.isfile(path):
+            candidates = [path]
+        else:
+            candidates = []
+            for root, dirs, files in os.walk(path):
+                dirs[:] = sorted(name for name in dirs if not name.startswith("."))
+                candidates.extend(os.path.join(root, name) for name in sorted(files) if not name.startswith("."))
+        for candidate in candidates:
+            if parsers.find(candidate) is not None:
+                found[source_name(candidate)] = candidate
+    return found
+
+
+def covers(roots, source):
+    # Whether source lies under one of the walked paths, i.e. would have been found if it still existed
+    return any(root == "." or source == root or source.startswith(root.rstrip("/") + "/") for root in roots)
+
+
+def load_manifest(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def save_manifest(path, manifest):
+    with open(f"{path}.tmp", "w") as f:
+        json.dump(manifest, f)
+    os.replace(f"{path}.tmp", path)
+
+
+def load_plugins(plugins):
+    # PARSER_PLUGINS, as in api.py
+    for plugin in plugins:
+        importlib.import_module(plugin)
+
+
+def init_worker(plugins, chunk_size):
+    load_plugins(plugins)
+    # The pool already keeps every core busy, so PDFs are not split across another pool of processes
+    parsers.configure("pdf", workers=1)
+    # Spreadsheet row groups are sized to fit in one chunk
+    parsers.configure("xlsx", chunk_size=chunk_size)
+
+
+def index_file(path, source, indexed_hash, chunk_size, chunk_overlap):
+    # Runs in a worker process. Returns the file's hash and its chunks, or None for the chunks when the index
+    # already holds this content.
+    content_hash = file_hash(path)
+    if content_hash == indexed_hash:
+        return content_hash, None
+    docs = list(chunk_segments(parsers.segments(path, path), source, chunk_size, chunk_overlap))
+    for doc in docs:
+        doc.metadata["content_hash"] = content_hash
+    return content_hash, docs
+
+
+def plan(files, manifest, state, force=False):
+    # Returns [(source, path, stat, hash the index holds for it)] for the files that may have changed, and the
+    # number of files that are skipped without reading them
+    todo = []
+    unchanged = 0
+    for source, path in files.items():
+        stat = os.stat(path)
+        entry = manifest.get(source)
+        indexed_hash = state.chunks.hashes.get(source)
+        if indexed_hash is None and entry and not entry["chunks"] and source not in state.chunks.source_table:
+            # Files without any text have no chunks to carry their hash
+            indexed_hash = entry["hash"]
+        if force:
+            indexed_hash = None
+        if (entry and indexed_hash == entry["hash"] and entry["size"] == stat.st_size
+                and entry["mtime_ns"] == stat.st_mtime_ns):
+            unchanged += 1
+            continue
+        todo.append((source, path, stat, indexed_hash))
+    return todo, unchanged
+
+
+class BulkIndexer:
+    def __init__(self, collection, commit_chunks=50000):
+        self.collection = collection
+        self.commit_chunks = commit_chunks
+        self.manifest_path = os.path.join(collection.directory, MANIFEST)
+        self.manifest = load_manifest(self.manifest_path)
+        # Parsed sources waiting for the next commit, and their manifest entries
+        self.batch = {}
+        self.entries = {}
+        self.batch_chunks = 0
+        self.report = {"files": 0, "unchanged": 0, "indexed": 0, "failed": 0, "removed": 0, "chunks": 0, "commits": 0,
+                       "errors": [], "embed_seconds": 0.0, "commit_seconds": 0.0}
+
+    def add(self, source, entry, docs):
+        self.batch[source] = docs
+        self.entries[source] = entry
+        self.batch_chunks += len(docs)
+        if self.batch_chunks >= self.commit_chunks:
+            self.commit()
+
+    def commit(self, removed=()):
+        # Embeds the batch outside the writer lock, then swaps it into the collection and saves a snapshot
+        if not self.batch and not removed:
+            save_manifest(self.manifest_path, self.manifest)
+            return
+        store = self.collection.store
+        docs = [doc for docs in self.batch.values() for doc in docs]
+        start = time.perf_counter()
+        vectors = store.embed(docs)
+        self.report["embed_seconds"] += time.perf_counter() - start
+        start = time.perf_counter()
+        with self.collection:
+            if removed:
+                self.report["removed"] += len(removed)
+                store.remove_sources(removed)
+            if self.batch:
+                store.replace_sources(self.batch, vectors=vectors)
+            self.collection.save()
+        self.report["commit_seconds"] += time.perf_counter() - start
+        for source in removed:
+            self.manifest.pop(source, None)
+        self.manifest.update(self.entries)
+        save_manifest(self.manifest_path, self.manifest)
+        self.report["commits"] += 1
+        self.report["indexed"] += len(self.batch)
+        self.report["chunks"] += len(docs)
+        logger.info(f"Committed {len(self.batch)} files ({len(docs)} chunks), removed {len(removed)}; "
+                    f"{len(store)} chunks in collection {self.collection.name}.")
+        self.batch, self.entries, self.batch_chunks = {}, {}, 0
+
+    def run(self, paths, workers, chunk_size=1000, chunk_overlap=200, force=False, keep_missing=False, plugins=()):
+        os.makedirs(self.collection.directory, exist_ok=True)
+        state = self.collection.state()
+        files = find_files(paths)
+        todo, self.report["unchanged"] = plan(files, self.manifest, state, force)
+        self.report["files"] = len(files)
+        roots = [source_name(path) for path in paths]
+        missing = [] if keep_missing else [source for source in self.manifest
+                                           if source not in files and covers(roots, source)]
+        logger.info(f"{len(files)} files found: {len(todo)} to check, {self.report['unchanged']} unchanged, "
+                    f"{len(missing)} to remove.")
+
+        # A bounded number of files are in flight, so parsed chunks wait in memory for at most one commit
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(tuple(plugins), chunk_size)) as pool:
+            queue = deque(todo)
+            pending = deque()
+            while queue or pending:
+                while queue and len(pending) < 4 * workers:
+                    source, path, stat, indexed_hash = queue.popleft()
+                    future = pool.submit(index_file, path, source, indexed_hash, chunk_size, chunk_overlap)
+                    pending.append((source, path, stat, future))
+                source, path, stat, future = pending.popleft()
+                try:
+                    content_hash, docs = future.result()
+                except Exception as e:
+                    logger.error(f"Could not index {path}: {e}")
+                    self.report["failed"] += 1
+                    self.report["errors"].append(f"{path}: {e}")
+                    continue
+                entry = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "hash": content_hash}
+                if docs is None:
+                    # Touched but not changed: only the recorded mtime moves
+                    self.manifest[source] = {**entry, "chunks": int(len(state.chunks.rows_of([source])))}
+                    self.report["unchanged"] += 1
+                    continue
+                self.add(source, {**entry, "chunks": len(docs)}, docs)
+        self.commit(removed=missing)
+        return self.report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Index directories of documents into a snapshot the API loads.")
+    parser.add_argument("paths", nargs="+", help="files and directories to index")
+    parser.add_argument("--snapshot", default=None, help="snapshot directory (default: SNAPSHOT_DIR or 'snapshot')")
+    parser.add_argument("--collection", default=DEFAULT_COLLECTION)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="parser processes")
+    parser.add_argument("--commit-chunks", type=int, default=50000, help="chunks embedded and committed at a time")
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    parser.add_argument("--chunk-overlap", type=int, default=200)
+    parser.add_argument("--force", action="store_true", help="re-index every file, even unchanged ones")
+    parser.add_argument("--keep-missing", action="store_true", help="keep the chunks of files that no longer exist")
+    parser.add_argument("--json", help="write the report to this file")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    load_dotenv()
+    snapshot_dir = args.snapshot or os.getenv("SNAPSHOT_DIR") or "snapshot"
+    plugins = [name.strip() for name in os.getenv("PARSER_PLUGINS", "").split(",") if name.strip()]
+    load_plugins(plugins)
+
+    embeddings, embedding_client, embedding_cache = backends.embedding_backend()
+    collections = CollectionManager(lambda: backends.make_store(embeddings), snapshot_dir=snapshot_dir)
+    try:
+        collection = collections.get(args.collection, create=True)
+    except ValueError as e:
+        raise SystemExit(str(e))
+
+    start = time.perf_counter()
+    report = BulkIndexer(collection, args.commit_chunks).run(
+        args.paths, max(1, args.workers), args.chunk_size, args.chunk_overlap, args.force, args.keep_missing, plugins)
+    report["seconds"] = round(time.perf_counter() - start, 2)
+    report["embedding"] = embedding_client.stats()
+    if embedding_cache is not None:
+        report["embedding_cache"] = {"hits": embedding_cache.hits, "misses": embedding_cache.misses}
+
+    print(f"{report['files']} files: {report['indexed']} indexed ({report['chunks']} chunks), {report['unchanged']} unchanged, "
+          f"{report['removed']} removed, {report['failed']} failed in {report['seconds']} s")
+    for error in report["errors"]:
+        print(f"  {error}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
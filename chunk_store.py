@@ -0,0 +1,200 @@
+## summary of the code below ##
+## ChunkStore holds the chunks of one index version in a few flat arrays instead of one Document object per chunk:
+##   texts             every chunk's UTF-8 text, concatenated, with int64 offsets (one more than the number of chunks)
+##   sources           table of source names; source_ids holds each chunk's int32 index into it
+##   pages             int32 page number per chunk, -1 when the source has no pages
+##   spans             int64 (start, end) character offsets of the chunk in its source text, -1 when unknown
+##   metadata          per-chunk JSON of any other metadata, usually empty (offsets in metadata_offsets)
+##   hashes            content hash per source, for sources ingested with a "content_hash" (e.g. uploads), so an
+##                     unchanged re-upload can be recognized without parsing it
+## Documents are only built for the chunks that are read, e.g. the top-k hits of a search. A ChunkStore is never
+## changed: extend() and select() return new stores, so readers of an older index version are unaffected.
+## The same arrays are the snapshot file format (see snapshot.py), so a loaded snapshot is served from memory maps.
+#################
+
+import json
+import os
+
+import numpy as np
+
+# Metadata keys kept in typed arrays; everything else goes to the per-chunk JSON
+_COLUMN_KEYS = ("source", "page", "start_index", "end_index", "content_hash")
+
+
+def _map_bytes(path):
+    # np.memmap refuses empty files
+    if os.path.getsize(path) == 0:
+        return np.zeros(0, dtype=np.uint8)
+    return np.memmap(path, dtype=np.uint8, mode="r")
+
+
+def _pack(blobs):
+    # Concatenated bytes and their lengths
+    lengths = np.fromiter(map(len, blobs), dtype=np.int64, count=len(blobs))
+    return np.frombuffer(b"".join(blobs), dtype=np.uint8), lengths
+
+
+def _gather(buffer, offsets, keep):
+    # Bytes and offsets of the kept entries, without a Python loop over them
+    lengths = np.diff(offsets)
+    kept = lengths[keep]
+    new_offsets = np.zeros(len(kept) + 1, dtype=np.int64)
+    np.cumsum(kept, out=new_offsets[1:])
+    return np.asarray(buffer)[np.repeat(keep, lengths)], new_offsets
+
+
+class ChunkStore:
+    def __init__(self, texts=None, offsets=None, sources=(), source_ids=None, pages=None, spans=None,
+                 metadata=None, metadata_offsets=None, hashes=None):
+        self.source_ids = np.zeros(0, dtype=np.int32) if source_ids is None else source_ids
+        count = len(self.source_ids)
+        self.texts = np.zeros(0, dtype=np.uint8) if texts is None else texts
+        self.offsets = np.zeros(count + 1, dtype=np.int64) if offsets is None else offsets
+        self.sources = list(sources)
+        self.pages = np.full(count, -1, dtype=np.int32) if pages is None else pages
+        self.spans = np.full((count, 2), -1, dtype=np.int64) if spans is None else spans
+        self.metadata = np.zeros(0, dtype=np.uint8) if metadata is None else metadata
+        self.metadata_offsets = np.zeros(count + 1, dtype=np.int64) if metadata_offsets is None else metadata_offsets
+        self.source_table = {source: i for i, source in enumerate(self.sources)}
+        self.hashes = dict(hashes or {})
+
+    def __len__(self):
+        return len(self.source_ids)
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("chunk index out of range")
+        return self.document(i)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.document(i)
+
+    def text(self, i):
+        return bytes(self.texts[self.offsets[i]:self.offsets[i + 1]]).decode("utf-8")
+
+    def source(self, i):
+        return self.sources[self.source_ids[i]]
+
+    def document(self, i):
+        # LangChain is imported on first use, not when the server starts
+        from langchain.schema import Document
+
+        metadata = {"source": self.source(i)}
+        if metadata["source"] in self.hashes:
+            metadata["content_hash"] = self.hashes[metadata["source"]]
+        if self.pages[i] >= 0:
+            metadata["page"] = int(self.pages[i])
+        if self.spans[i, 0] >= 0:
+            metadata["start_index"], metadata["end_index"] = int(self.spans[i, 0]), int(self.spans[i, 1])
+        start, end = self.metadata_offsets[i], self.metadata_offsets[i + 1]
+        if end > start:
+            metadata.update(json.loads(bytes(self.metadata[start:end])))
+        return Document(page_content=self.text(i), metadata=metadata)
+
+    def nbytes(self):
+        return sum(np.asarray(array).nbytes for array in (self.texts, self.offsets, self.source_ids, self.pages,
+                                                          self.spans, self.metadata, self.metadata_offsets))
+
+    def documents(self, rows):
+        return [self.document(i) for i in rows]
+
+    def rows_of(self, sources):
+        # Row numbers of every chunk of the given sources
+        ids = [self.source_table[source] for source in sources if source in self.source_table]
+        if not ids:
+            return np.zeros(0, dtype=np.int64)
+        return np.flatnonzero(np.isin(self.source_ids, ids))
+
+    def extend(self, docs):
+        # New store with docs appended; the source table only ever holds sources that have chunks
+        if not docs:
+            return self
+        table = dict(self.source_table)
+        hashes = dict(self.hashes)
+        hashes.update((doc.metadata["source"], doc.metadata["content_hash"]) for doc in docs if doc.metadata.get("content_hash"))
+        source_ids = np.fromiter((table.setdefault(doc.metadata["source"], len(table)) for doc in docs),
+                                 dtype=np.int32, count=len(docs))
+        texts, lengths = _pack([doc.page_content.encode("utf-8") for doc in docs])
+        pages = np.fromiter((doc.metadata.get("page", -1) for doc in docs), dtype=np.int32, count=len(docs))
+        spans = np.full((len(docs), 2), -1, dtype=np.int64)
+        extras = []
+        for i, doc in enumerate(docs):
+            start = doc.metadata.get("start_index")
+            if start is not None:
+                spans[i] = start, doc.metadata.get("end_index", start + len(doc.page_content))
+            extra = {key: value for key, value in doc.metadata.items() if key not in _COLUMN_KEYS}
+            extras.append(json.dumps(extra).encode("utf-8") if extra else b"")
+        metadata, metadata_lengths = _pack(extras)
+        return ChunkStore(
+            texts=np.concatenate([self.texts, texts]),
+            offsets=np.concatenate([self.offsets, self.offsets[-1] + np.cumsum(lengths)]),
+            sources=list(table),
+            source_ids=np.concatenate([self.source_ids, source_ids]),
+            pages=np.concatenate([self.pages, pages]),
+            spans=np.concatenate([self.spans, spans]),
+            metadata=np.concatenate([self.metadata, metadata]),
+            metadata_offsets=np.concatenate([self.metadata_offsets, self.metadata_offsets[-1] + np.cumsum(metadata_lengths)]),
+            hashes=hashes,
+        )
+
+    def select(self, keep):
+        # New store with only the rows where the boolean mask keep is set, in order
+        keep = np.asarray(keep, dtype=bool)
+        texts, offsets = _gather(self.texts, self.offsets, keep)
+        metadata, metadata_offsets = _gather(self.metadata, self.metadata_offsets, keep)
+        used, source_ids = np.unique(np.asarray(self.source_ids)[keep], return_inverse=True)
+        sources = [self.sources[i] for i in used]
+        return ChunkStore(
+            texts=texts,
+            offsets=offsets,
+            sources=sources,
+            source_ids=source_ids.astype(np.int32).reshape(-1),
+            pages=np.asarray(self.pages)[keep],
+            spans=np.asarray(self.spans)[keep],
+            metadata=metadata,
+            metadata_offsets=metadata_offsets,
+            hashes={source: self.hashes[source] for source in sources if source in self.hashes},
+        )
+
+    def save(self, path):
+        # Writes the arrays into the directory path; the source table is returned for the caller's manifest
+        np.save(os.path.join(path, "offsets.npy"), np.asarray(self.offsets))
+        np.save(os.path.join(path, "source_ids.npy"), np.asarray(self.source_ids))
+        np.save(os.path.join(path, "pages.npy"), np.asarray(self.pages))
+        np.save(os.path.join(path, "spans.npy"), np.asarray(self.spans))
+        np.save(os.path.join(path, "metadata_offsets.npy"), np.asarray(self.metadata_offsets))
+        with open(os.path.join(path, "texts.bin"), "wb") as f:
+            f.write(memoryview(np.ascontiguousarray(self.texts)))
+        with open(os.path.join(path, "metadata.bin"), "wb") as f:
+            f.write(memoryview(np.ascontiguousarray(self.metadata)))
+        with open(os.path.join(path, "hashes.json"), "w") as f:
+            json.dump(self.hashes, f)
+        return list(self.sources)
+
+    @classmethod
+    def load(cls, path, sources):
+        # Memory-maps a saved store. Snapshots written before pages and spans had columns keep them in the JSON.
+        def load_array(name):
+            file = os.path.join(path, name)
+            return np.load(file, mmap_mode="r") if os.path.exists(file) else None
+
+        hashes_path = os.path.join(path, "hashes.json")
+        hashes = None
+        if os.path.exists(hashes_path):
+            with open(hashes_path) as f:
+                hashes = json.load(f)
+
+        return cls(
+            texts=_map_bytes(os.path.join(path, "texts.bin")),
+            offsets=load_array("offsets.npy"),
+            sources=sources,
+            source_ids=load_array("source_ids.npy"),
+            pages=load_array("pages.npy"),
+            spans=load_array("spans.npy"),
+            metadata=_map_bytes(os.path.join(path, "metadata.bin")),
+            metadata_offsets=load_array("metadata_offsets.npy"),
+            hashes=hashes,
+        )
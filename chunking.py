@@ -0,0 +1,61 @@
+## summary of the code below ##
+## Streaming chunker: turns an iterator of (text, metadata) segments, such as PDF pages, into chunk Documents.
+## Only a window of recent text is buffered. When the window fills up it is split, every chunk but the last is
+## emitted, and the last one is carried over because it may continue in the next segment.
+## Each chunk gets the source plus the metadata of the segment it starts in (e.g. its page number), and its
+## start_index in the concatenated text of all segments.
+#################
+
+from bisect import bisect_right
+
+# Text buffered before splitting, in multiples of chunk_size
+WINDOW_CHUNKS = 16
+
+
+def chunk_segments(segments, source, chunk_size=1000, chunk_overlap=200):
+    # LangChain is imported on first use, not when the server starts
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+    text_splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap, add_start_index=True)
+    window = chunk_size * WINDOW_CHUNKS
+    parts = []
+    buffered = 0
+    # Offset of the buffer in the whole text
+    base = 0
+    # Offsets into the buffer where each segment starts, with that segment's metadata
+    starts = []
+    metadatas = []
+    for text, metadata in segments:
+        if not text:
+            continue
+        starts.append(buffered)
+        metadatas.append(metadata)
+        parts.append(text)
+        buffered += len(text)
+        if buffered < window:
+            continue
+
+        buffer = "".join(parts)
+        chunks = text_splitter.create_documents([buffer])
+        for chunk in chunks[:-1]:
+            yield _document(chunk, source, base, starts, metadatas)
+        cut = chunks[-1].metadata["start_index"] if len(chunks) > 1 else 0
+        first = max(0, bisect_right(starts, cut) - 1)
+        base += cut
+        parts = [buffer[cut:]]
+        buffered = len(parts[0])
+        starts = [max(0, start - cut) for start in starts[first:]]
+        metadatas = metadatas[first:]
+
+    if parts:
+        for chunk in text_splitter.create_documents(["".join(parts)]):
+            yield _document(chunk, source, base, starts, metadatas)
+
+
+def _document(chunk, source, base, starts, metadatas):
+    from langchain.schema import Document
+
+    start = chunk.metadata["start_index"]
+    segment = max(0, bisect_right(starts, start) - 1)
+    return Document(page_content=chunk.page_content,
+                    metadata={"source": source, **metadatas[segment], "start_index": base + start})
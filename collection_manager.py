@@ -0,0 +1,209 @@
+## summary of the code below ##
+## Named collections (namespaces) of documents. Each collection has its own VectorStore, i.e. its own FAISS index
+## shard and chunk store, so a question asked in one collection only searches that collection's index, and
+## re-uploading a source only replaces it within its collection.
+## With a snapshot directory every collection is snapshotted on its own (see snapshot.py): the "default" collection
+## in the directory itself, as before collections existed, and any other one in collections/<name> below it.
+## Collections are loaded on first use. When the loaded collections take more than memory_budget bytes, the least
+## recently used ones are paged out: their state is dropped (the snapshot stays on disk) and memory-mapped back on
+## their next request. Only saved collections that nobody is changing are paged out, so no change is lost.
+#################
+
+import logging
+import os
+import re
+import threading
+import time
+
+from chunk_store import ChunkStore
+from snapshot import SnapshotWriter, current_version, load_snapshot, refresh_snapshot, save_snapshot
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_COLLECTION = "default"
+
+# Collection names become directory names
+_NAME = re.compile(r"[A-Za-z0-9][A-Za-z0-9_-]{0,63}")
+
+
+def valid_name(name):
+    return isinstance(name, str) and _NAME.fullmatch(name) is not None
+
+
+class Collection:
+    """One named collection: its store, its snapshot directory (None without snapshots) and its writer lock.
+
+    Entering a collection serializes changes to it (across processes too, through SnapshotWriter) and loads it if
+    it is paged out, so a change is always applied on top of its latest state.
+    """
+
+    def __init__(self, manager, name, store, directory):
+        self.manager = manager
+        self.name = name
+        self.store = store
+        self.directory = directory
+        self.writer = SnapshotWriter(store, directory) if directory else threading.Lock()
+        # False until loaded and while paged out; a collection without snapshots lives in memory only
+        self.resident = directory is None
+        self.last_used = time.monotonic()
+        self.lock = threading.Lock()
+
+    def __enter__(self):
+        self.writer.__enter__()
+        try:
+            self.manager._load(self)
+        except BaseException:
+            self.writer.__exit__(None, None, None)
+            raise
+        return self
+
+    def __exit__(self, *exc_info):
+        self.writer.__exit__(*exc_info)
+        self.manager._used(self)
+
+    def state(self):
+        # The current state for a reader, loaded first if the collection is paged out
+        state = self.manager._load(self)
+        self.manager._used(self)
+        return state
+
+    def save(self):
+        # Called inside the with block, after a change
+        if self.directory:
+            save_snapshot(self.store, self.directory)
+
+    def memory_bytes(self):
+        return self.store.state.memory_bytes() if self.resident else 0
+
+    def stats(self):
+        state = self.store.state
+        return {
+            "name": self.name,
+            "resident": self.resident,
+            "chunks": len(state) if self.resident else None,
+            "sources": len(state.chunks.sources) if self.resident else None,
+            "memory_bytes": self.memory_bytes(),
+            "idle_seconds": round(time.monotonic() - self.last_used, 1),
+        }
+
+
+class CollectionManager:
+    def __init__(self, make_store, snapshot_dir=None, memory_budget=0):
+        # make_store() returns an empty VectorStore with the configured index settings
+        self.make_store = make_store
+        self.snapshot_dir = snapshot_dir
+        # Bytes; 0 keeps every loaded collection in memory. Without snapshots nothing can be paged out.
+        self.memory_budget = memory_budget
+        self.collections = {}
+        self.lock = threading.Lock()
+        self.loads = 0
+        self.evictions = 0
+
+    def directory(self, name):
+        if not self.snapshot_dir:
+            return None
+        if name == DEFAULT_COLLECTION:
+            return self.snapshot_dir
+        return os.path.join(self.snapshot_dir, "collections", name)
+
+    def names(self):
+        # Collections opened by this process and those any process saved to the snapshot directory
+        names = {DEFAULT_COLLECTION, *self.collections}
+        if self.snapshot_dir:
+            try:
+                names.update(name for name in os.listdir(os.path.join(self.snapshot_dir, "collections")) if valid_name(name))
+            except FileNotFoundError:
+                pass
+        return sorted(names)
+
+    def _exists(self, name):
+        return (name == DEFAULT_COLLECTION or name in self.collections
+                or (self.snapshot_dir is not None and current_version(self.directory(name)) is not None))
+
+    def get(self, name, create=False):
+        # None for a collection that does not exist yet, unless create is set; ValueError for an invalid name
+        if not valid_name(name):
+            raise ValueError(f"Invalid collection name: {name!r}")
+        with self.lock:
+            collection = self.collections.get(name)
+            if collection is None:
+                if not create and not self._exists(name):
+                    return None
+                collection = Collection(self, name, self.make_store(), self.directory(name))
+                self.collections[name] = collection
+                logger.info(f"Opened collection {name}.")
+        return collection
+
+    def resident(self):
+        with self.lock:
+            return [collection for collection in self.collections.values() if collection.resident]
+
+    def _load(self, collection):
+        with collection.lock:
+            if not collection.resident:
+                start = time.perf_counter()
+                # A concurrent refresh may have loaded the latest version already
+                if collection.store.snapshot_version != current_version(collection.directory):
+                    load_snapshot(collection.store, collection.directory)
+                collection.resident = True
+                self.loads += 1
+                logger.info(f"Loaded collection {collection.name} ({len(collection.store)} chunks) in "
+                            f"{(time.perf_counter() - start) * 1000:.1f} ms.")
+            return collection.store.state
+
+    def _used(self, collection):
+        collection.last_used = time.monotonic()
+        if self.memory_budget and self.snapshot_dir:
+            self.enforce_budget(keep=collection)
+
+    def memory_bytes(self):
+        return sum(collection.memory_bytes() for collection in self.resident())
+
+    def enforce_budget(self, keep=None):
+        # Pages out the least recently used collections until the resident ones fit the budget
+        sizes = {collection: collection.memory_bytes() for collection in self.resident()}
+        total = sum(sizes.values())
+        for collection in sorted(sizes, key=lambda c: c.last_used):
+            if total <= self.memory_budget:
+                break
+            if collection is not keep and self.evict(collection):
+                total -= sizes[collection]
+
+    def evict(self, collection):
+        # Drops the state of a saved collection nobody is changing; False if it has unsaved changes or is busy
+        if collection.directory is None:
+            return False
+        with collection.lock:
+            if not collection.resident or not collection.writer.lock.acquire(blocking=False):
+                return False
+            try:
+                store = collection.store
+                with store.write_lock:
+                    if store.unsaved():
+                        return False
+                    store.swap(None, ChunkStore(), None)
+                    store.snapshot_version = store.snapshot_state_version = None
+                collection.resident = False
+            finally:
+                collection.writer.lock.release()
+        self.evictions += 1
+        logger.info(f"Paged out collection {collection.name}.")
+        return True
+
+    def refresh(self):
+        # Picks up versions saved by other processes; paged-out collections get the latest one when loaded
+        for collection in self.resident():
+            if collection.directory:
+                refresh_snapshot(collection.store, collection.directory, blocking=False)
+
+    def stats(self):
+        with self.lock:
+            opened = dict(self.collections)
+        return {
+            "collections": [opened[name].stats() if name in opened else {"name": name, "resident": False}
+                            for name in self.names()],
+            "memory_bytes": self.memory_bytes(),
+            "memory_budget": self.memory_budget,
+            "loads": self.loads,
+            "evictions": self.evictions,
+        }
@@ -0,0 +1,130 @@
+## summary of the code below ##
+## ContextBuilder turns the retrieved chunks of a question into the context passages of the prompt, within a token budget.
+##  1. Candidates are ordered by maximal marginal relevance (MMR) over the vectors the search already returned, and
+##     near-duplicates of a passage that is already chosen (cosine similarity at or above redundancy_threshold) are dropped.
+##  2. In that order, each chunk is added if the context still fits max_tokens. A chunk that overlaps or touches a chosen
+##     chunk of the same source (by the character spans recorded at chunking) is merged into one passage, so the
+##     overlap is sent once. The most relevant chunk is always sent: if it alone exceeds max_tokens, it is cut to fit.
+## Passages keep the order of their most relevant chunk. build() also reports token counts, so the prompt savings
+## can be measured (see /ask with "timings": true and the docstalk_context_* metrics).
+#################
+
+import numpy as np
+
+from embedding_client import TokenCounter
+
+
+class Passage:
+    def __init__(self, source, start, end, text, rank, chunks=1):
+        self.source = source
+        # Character span in the source text; None for chunks indexed without one
+        self.start = start
+        self.end = end
+        self.text = text
+        # Position of its most relevant chunk in the MMR order
+        self.rank = rank
+        self.chunks = chunks
+
+    @classmethod
+    def from_document(cls, doc, rank):
+        start = doc.metadata.get("start_index")
+        end = doc.metadata.get("end_index", None if start is None else start + len(doc.page_content))
+        return cls(doc.metadata["source"], start, end, doc.page_content, rank)
+
+    def touches(self, other):
+        return (self.source == other.source and self.start is not None and other.start is not None
+                and other.start <= self.end and other.end >= self.start)
+
+    def merged(self, other):
+        # Both texts are slices of the same source text, so the overlap is cut by offsets
+        text = (other.text[:self.start - other.start] if other.start < self.start else "") + self.text + \
+            (other.text[self.end - other.start:] if other.end > self.end else "")
+        return Passage(self.source, min(self.start, other.start), max(self.end, other.end), text,
+                       min(self.rank, other.rank), self.chunks + other.chunks)
+
+    def truncated(self, text):
+        # Same passage cut down to a prefix of its text
+        end = None if self.start is None else self.start + len(text)
+        return Passage(self.source, self.start, end, text, self.rank, self.chunks)
+
+
+def mmr_order(query, vectors, mmr_lambda=0.7, redundancy_threshold=0.95):
+    # Returns (order, dropped): candidate rows by marginal relevance, and rows too similar to an earlier pick
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if not len(vectors):
+        return [], []
+    vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    query = np.asarray(query, dtype=np.float32).reshape(-1)
+    query = query / max(float(np.linalg.norm(query)), 1e-12)
+    relevance = vectors @ query
+    similarity = vectors @ vectors.T
+    remaining = list(range(len(vectors)))
+    order = []
+    dropped = []
+    while remaining:
+        if order:
+            redundancy = similarity[np.ix_(remaining, order)].max(axis=1)
+        else:
+            redundancy = np.zeros(len(remaining))
+        scores = mmr_lambda * relevance[remaining] - (1 - mmr_lambda) * redundancy
+        best = int(np.argmax(scores))
+        row = remaining.pop(best)
+        if order and redundancy[best] >= redundancy_threshold:
+            dropped.append(row)
+        else:
+            order.append(row)
+    return order, dropped
+
+
+class ContextBuilder:
+    def __init__(self, max_tokens=1500, mmr_lambda=0.7, redundancy_threshold=0.95, token_counter=None):
+        # max_tokens=0 lifts the budget; chunks are still merged and de-duplicated
+        self.max_tokens = max_tokens
+        self.mmr_lambda = mmr_lambda
+        self.redundancy_threshold = redundancy_threshold
+        self.token_counter = token_counter or TokenCounter()
+
+    def count(self, text):
+        return self.token_counter.count(text)
+
+    def build(self, query_embedding, docs, vectors):
+        # docs are the search hits in relevance order, vectors their embeddings; returns (passages, stats)
+        order, dropped = mmr_order(query_embedding, vectors, self.mmr_lambda, self.redundancy_threshold)
+        passages = []
+        tokens = []
+        skipped = 0
+        truncated = 0
+        for rank, row in enumerate(order):
+            candidate = Passage.from_document(docs[row], rank)
+            # The chunk may join one passage, or bridge several passages of its source into one
+            merged = [i for i, passage in enumerate(passages) if passage.touches(candidate)]
+            for i in merged:
+                candidate = passages[i].merged(candidate)
+            candidate_tokens = self.count(candidate.text)
+            if self.max_tokens and sum(tokens) + candidate_tokens - sum(tokens[i] for i in merged) > self.max_tokens:
+                if passages:
+                    skipped += 1
+                    continue
+                # The top passage is the one the answer most likely needs, so it is cut rather than skipped
+                candidate = candidate.truncated(self.token_counter.truncate(candidate.text, self.max_tokens))
+                candidate_tokens = self.count(candidate.text)
+                truncated += 1
+            for i in reversed(merged):
+                del passages[i]
+                del tokens[i]
+            passages.append(candidate)
+            tokens.append(candidate_tokens)
+        order_by_rank = sorted(range(len(passages)), key=lambda i: passages[i].rank)
+        passages = [passages[i] for i in order_by_rank]
+        stats = {
+            "retrieved_chunks": len(docs),
+            "retrieved_tokens": sum(self.count(doc.page_content) for doc in docs),
+            "used_chunks": sum(passage.chunks for passage in passages),
+            "passages": len(passages),
+            "redundant_chunks": len(dropped),
+            "over_budget_chunks": skipped,
+            "truncated_passages": truncated,
+            "context_tokens": sum(tokens),
+        }
+        return passages, stats
+
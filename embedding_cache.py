@@ -0,0 +1,198 @@
+## summary of the code below ##
+## EmbeddingCache is an on-disk, content-addressed store of chunk embeddings shared across restarts and endpoints.
+## Keys are sha256(deployment name + chunk text) kept in an SQLite table that maps each key to a row of a
+## memory-mapped float32 matrix. When the matrix would grow past max_bytes, the least recently used rows are evicted
+## and reused. CachedEmbeddings wraps an embeddings client so cache hits never reach the network.
+#################
+
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# SQLite limits the number of bound parameters per statement
+_SQL_BATCH = 500
+
+
+def cache_key(model_name, text):
+    return hashlib.sha256(f"{model_name}\0{text}".encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    def __init__(self, directory, model_name, max_bytes=1024 * 1024 * 1024):
+        os.makedirs(directory, exist_ok=True)
+        self.model_name = model_name or ""
+        self.max_bytes = max_bytes
+        self.matrix_path = os.path.join(directory, "vectors.f32")
+        # Autocommit mode: every access runs in an explicit BEGIN IMMEDIATE transaction so several
+        # processes can share the directory without reading a row while it is being reused
+        self.db = sqlite3.connect(os.path.join(directory, "keys.sqlite"), isolation_level=None,
+                                  check_same_thread=False, timeout=30)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, row INTEGER NOT NULL, last_used REAL NOT NULL)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS free_rows (row INTEGER PRIMARY KEY)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+        self.lock = threading.Lock()
+        self.matrix = None
+        self.dimension = self._meta("dimension")
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _meta(self, name, default=None):
+        row = self.db.execute("SELECT value FROM meta WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else default
+
+    def _set_meta(self, name, value):
+        self.db.execute("INSERT OR REPLACE INTO meta (name, value) VALUES (?, ?)", (name, value))
+
+    def _max_rows(self):
+        return max(1, self.max_bytes // (self.dimension * 4))
+
+    def _map(self, rows_needed=0):
+        # Re-map when another process (or this one) has grown the file past the current mapping
+        row_bytes = self.dimension * 4
+        size = os.path.getsize(self.matrix_path) if os.path.exists(self.matrix_path) else 0
+        if size < rows_needed * row_bytes:
+            capacity = min(max(rows_needed, 2 * (size // row_bytes), 1024), max(rows_needed, self._max_rows()))
+            with open(self.matrix_path, "ab") as f:
+                f.truncate(capacity * row_bytes)
+            size = capacity * row_bytes
+        if self.matrix is None or self.matrix.shape[0] * row_bytes < size:
+            self.matrix = np.memmap(self.matrix_path, dtype=np.float32, mode="r+", shape=(size // row_bytes, self.dimension))
+        return self.matrix
+
+    def get_many(self, texts):
+        results = [None] * len(texts)
+        if not texts:
+            return results
+        keys = [cache_key(self.model_name, text) for text in texts]
+        with self.lock:
+            self.db.execute("BEGIN IMMEDIATE")
+            try:
+                rows = {}
+                for start in range(0, len(keys), _SQL_BATCH):
+                    batch = list(set(keys[start:start + _SQL_BATCH]))
+                    placeholders = ",".join("?" * len(batch))
+                    rows.update(self.db.execute(f"SELECT key, row FROM entries WHERE key IN ({placeholders})", batch))
+                if rows:
+                    self.dimension = self.dimension or self._meta("dimension")
+                    matrix = self._map()
+                    for i, key in enumerate(keys):
+                        if key in rows:
+                            results[i] = matrix[rows[key]].tolist()
+                    now = time.time()
+                    self.db.executemany("UPDATE entries SET last_used = ? WHERE key = ?", [(now, key) for key in rows])
+                self.db.execute("COMMIT")
+            except BaseException:
+                self.db.execute("ROLLBACK")
+                raise
+        hits = sum(result is not None for result in results)
+        self.hits += hits
+        self.misses += len(texts) - hits
+        return results
+
+    def put_many(self, texts, vectors):
+        if not texts:
+            return
+        vectors = np.asarray(vectors, dtype=np.float32)
+        with self.lock:
+            self.db.execute("BEGIN IMMEDIATE")
+            try:
+                if self.dimension is None:
+                    self.dimension = self._meta("dimension") or vectors.shape[1]
+                    self._set_meta("dimension", self.dimension)
+                if vectors.shape[1] != self.dimension:
+                    logger.warning(f"Not caching {vectors.shape[1]}-d embeddings in a {self.dimension}-d cache.")
+                    self.db.execute("COMMIT")
+                    return
+
+                # Only the newest max_rows entries can fit; skip keys another process already stored
+                new = {}
+                for text, vector in zip(texts, vectors):
+                    new[cache_key(self.model_name, text)] = vector
+                max_rows = self._max_rows()
+                keys = list(new)[-max_rows:]
+                for start in range(0, len(keys), _SQL_BATCH):
+                    batch = keys[start:start + _SQL_BATCH]
+                    placeholders = ",".join("?" * len(batch))
+                    for (key,) in self.db.execute(f"SELECT key FROM entries WHERE key IN ({placeholders})", batch):
+                        new.pop(key, None)
+                keys = [key for key in keys if key in new]
+                if not keys:
+                    self.db.execute("COMMIT")
+                    return
+
+                count = self.db.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+                overflow = count + len(keys) - max_rows
+                if overflow > 0:
+                    evicted = self.db.execute("SELECT key, row FROM entries ORDER BY last_used LIMIT ?", (overflow,)).fetchall()
+                    self.db.executemany("DELETE FROM entries WHERE key = ?", [(key,) for key, _ in evicted])
+                    self.db.executemany("INSERT INTO free_rows (row) VALUES (?)", [(row,) for _, row in evicted])
+                    self.evictions += len(evicted)
+
+                rows = [row for (row,) in self.db.execute("SELECT row FROM free_rows ORDER BY row LIMIT ?", (len(keys),))]
+                self.db.executemany("DELETE FROM free_rows WHERE row = ?", [(row,) for row in rows])
+                next_row = self._meta("next_row", 0)
+                while len(rows) < len(keys):
+                    rows.append(next_row)
+                    next_row += 1
+                self._set_meta("next_row", next_row)
+
+                # Vectors are written and flushed before their keys become visible to readers
+                matrix = self._map(next_row)
+                for key, row in zip(keys, rows):
+                    matrix[row] = new[key]
+                matrix.flush()
+                now = time.time()
+                self.db.executemany("INSERT INTO entries (key, row, last_used) VALUES (?, ?, ?)",
+                                    [(key, row, now) for key, row in zip(keys, rows)])
+                self.db.execute("COMMIT")
+            except BaseException:
+                self.db.execute("ROLLBACK")
+                raise
+
+    def stats(self):
+        with self.lock:
+            entries = self.db.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "entries": entries,
+            "bytes": entries * (self.dimension or 0) * 4,
+            "max_bytes": self.max_bytes,
+        }
+
+
+class CachedEmbeddings:
+    def __init__(self, embeddings, cache):
+        self.embeddings = embeddings
+        self.cache = cache
+
+    def embed_documents(self, texts):
+        texts = list(texts)
+        vectors = self.cache.get_many(texts)
+        served = sum(vector is not None for vector in vectors)
+        missing = list(dict.fromkeys(text for text, vector in zip(texts, vectors) if vector is None))
+        if missing:
+            fresh = dict(zip(missing, self.embeddings.embed_documents(missing)))
+            self.cache.put_many(missing, list(fresh.values()))
+            vectors = [fresh[text] if vector is None else vector for text, vector in zip(texts, vectors)]
+        logger.info(f"Embedding cache: {served} of {len(texts)} chunks served from cache.")
+        return vectors
+
+    def embed_query(self, text):
+        return self.embeddings.embed_query(text)
+
+    def embed_queries(self, texts):
+        return self.embeddings.embed_queries(texts)
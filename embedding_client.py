@@ -0,0 +1,175 @@
+## summary of the code below ##
+## BatchedEmbeddings sits in front of an embeddings client (AzureOpenAIEmbeddings or fake_embeddings.FakeEmbeddings).
+## Chunks are packed into requests by token count (and an input-count cap), up to max_concurrency requests run in
+## parallel on a shared pool, and a request that fails with a rate-limit or transient error is retried on its own
+## with exponential backoff, honouring Retry-After. A 429 also pauses every other request until the cool-down ends,
+## so the workers do not keep hammering a throttled deployment. Results come back in the order of the input texts.
+#################
+
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+logger = logging.getLogger(__name__)
+
+# HTTP statuses worth retrying: throttling, timeouts and server-side errors
+RETRY_STATUSES = (408, 409, 429, 500, 502, 503, 504)
+
+# Exception names raised by the openai/httpx clients for dropped connections and timeouts
+_TRANSIENT_ERRORS = ("APIConnectionError", "APITimeoutError", "ConnectTimeout", "ReadTimeout", "ConnectError")
+
+
+def status_code(error):
+    code = getattr(error, "status_code", None)
+    if code is None:
+        code = getattr(getattr(error, "response", None), "status_code", None)
+    return code
+
+
+def retry_after(error):
+    # Seconds the server asked us to wait, if it said so
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    value = headers.get("retry-after-ms")
+    if value is not None:
+        try:
+            return float(value) / 1000
+        except ValueError:
+            pass
+    try:
+        return float(headers.get("retry-after") or getattr(error, "retry_after", None))
+    except (TypeError, ValueError):
+        return None
+
+
+def is_retryable(error):
+    return (status_code(error) in RETRY_STATUSES or isinstance(error, (ConnectionError, TimeoutError))
+            or type(error).__name__ in _TRANSIENT_ERRORS)
+
+
+class TokenCounter:
+    def __init__(self, encoding="cl100k_base"):
+        self.encoding = None
+        if tiktoken is not None:
+            try:
+                self.encoding = tiktoken.get_encoding(encoding)
+            except Exception:
+                logger.warning(f"Could not load tiktoken encoding {encoding}; estimating tokens from length.")
+
+    def count(self, text):
+        if self.encoding is None:
+            # About four characters per token for English text
+            return len(text) // 4 + 1
+        return len(self.encoding.encode_ordinary(text))
+
+    def truncate(self, text, max_tokens):
+        # Longest prefix of text within max_tokens (by the same count)
+        if self.encoding is None:
+            return text[:4 * max_tokens - 1]
+        # A cut inside a multi-byte character decodes to a replacement character, which is dropped
+        return self.encoding.decode(self.encoding.encode_ordinary(text)[:max_tokens]).rstrip("\ufffd")
+
+
+def pack_batches(counts, max_tokens, max_inputs):
+    # Greedy in-order packing; a single text over max_tokens still gets a batch of its own
+    batches = []
+    start = 0
+    tokens = 0
+    for i, count in enumerate(counts):
+        if i > start and (tokens + count > max_tokens or i - start >= max_inputs):
+            batches.append((start, i))
+            start = i
+            tokens = 0
+        tokens += count
+    if start < len(counts):
+        batches.append((start, len(counts)))
+    return batches
+
+
+class BatchedEmbeddings:
+    def __init__(self, embeddings, max_batch_tokens=50000, max_batch_size=2048, max_concurrency=4, max_retries=6,
+                 backoff_base=1.0, backoff_max=60.0, token_counter=None):
+        self.embeddings = embeddings
+        self.max_batch_tokens = max_batch_tokens
+        self.max_batch_size = max_batch_size
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.token_counter = token_counter or TokenCounter()
+        self.pool = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="embed-request")
+        self.lock = threading.Lock()
+        # Monotonic time before which no request is sent, pushed forward by rate-limit responses
+        self.paused_until = 0.0
+        self.requests = 0
+        self.retries = 0
+        self.rate_limited = 0
+        self.tokens = 0
+
+    def embed_documents(self, texts):
+        texts = list(texts)
+        if not texts:
+            return []
+        counts = [self.token_counter.count(text) for text in texts]
+        batches = pack_batches(counts, self.max_batch_tokens, self.max_batch_size)
+        start = time.perf_counter()
+        futures = [self.pool.submit(self._call, self.embeddings.embed_documents, texts[i:j]) for i, j in batches]
+        vectors = []
+        for future in futures:
+            vectors.extend(future.result())
+        with self.lock:
+            self.tokens += sum(counts)
+        elapsed = time.perf_counter() - start
+        logger.info(f"Embedded {len(texts)} chunks ({sum(counts)} tokens) in {len(batches)} requests, {elapsed:.2f}s.")
+        return vectors
+
+    def embed_query(self, text):
+        return self._call(self.embeddings.embed_query, text)
+
+    def embed_queries(self, texts):
+        # Several questions share the batched document path; the model is the same as for embed_query
+        return self.embed_documents(texts)
+
+    def _wait(self):
+        with self.lock:
+            delay = self.paused_until - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+    def _call(self, method, payload):
+        attempt = 0
+        while True:
+            self._wait()
+            try:
+                with self.lock:
+                    self.requests += 1
+                return method(payload)
+            except Exception as e:
+                if attempt >= self.max_retries or not is_retryable(e):
+                    raise
+                delay = retry_after(e)
+                if delay is None:
+                    # Exponential backoff with full jitter
+                    delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+                attempt += 1
+                with self.lock:
+                    self.retries += 1
+                    if status_code(e) == 429:
+                        self.rate_limited += 1
+                        self.paused_until = max(self.paused_until, time.monotonic() + delay)
+                logger.warning(f"Embedding request failed ({e}); retry {attempt}/{self.max_retries} in {delay:.1f}s.")
+                time.sleep(delay)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "requests": self.requests,
+                "retries": self.retries,
+                "rate_limited": self.rate_limited,
+                "tokens": self.tokens,
+            }
@@ -0,0 +1,105 @@
+## summary of the code below ##
+## Offline stand-in for AzureOpenAIEmbeddings, used with EMBEDDING_BACKEND=fake and by the throughput report below.
+## Vectors are derived from a hash of the text, so the same chunk always gets the same unit-length vector.
+## Each request sleeps for a fixed latency plus a per-input cost, and a configurable share of requests fails with
+## a 429 (carrying Retry-After) or a 503, like a throttled or flaky deployment.
+## Example:
+##   python fake_embeddings.py --chunks 20000 --concurrency 8 --rate-limit 0.1 --server-errors 0.02
+#################
+
+import argparse
+import hashlib
+import random
+import threading
+import time
+
+import numpy as np
+
+
+class FakeResponse:
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+
+
+class FakeAPIError(Exception):
+    def __init__(self, message, status_code, headers=None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.response = FakeResponse(status_code, headers)
+
+
+class FakeEmbeddings:
+    def __init__(self, dimension=1536, latency=0.05, per_input_latency=0.0005, rate_limit=0.0, server_errors=0.0,
+                 retry_after=0.1, seed=0):
+        self.dimension = dimension
+        self.latency = latency
+        self.per_input_latency = per_input_latency
+        self.rate_limit = rate_limit
+        self.server_errors = server_errors
+        self.retry_after = retry_after
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.calls = 0
+
+    def vector(self, text):
+        seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+        vector = np.random.default_rng(seed).standard_normal(self.dimension).astype(np.float32)
+        return (vector / np.linalg.norm(vector)).tolist()
+
+    def _request(self, count):
+        with self.lock:
+            self.calls += 1
+            roll = self.rng.random()
+        time.sleep(self.latency + self.per_input_latency * count)
+        if roll < self.rate_limit:
+            raise FakeAPIError("Rate limit exceeded", 429, {"retry-after": str(self.retry_after)})
+        if roll < self.rate_limit + self.server_errors:
+            raise FakeAPIError("Service unavailable", 503)
+
+    def embed_documents(self, texts):
+        texts = list(texts)
+        self._request(len(texts))
+        return [self.vector(text) for text in texts]
+
+    def embed_query(self, text):
+        self._request(1)
+        return self.vector(text)
+
+
+def main():
+    from embedding_client import BatchedEmbeddings
+
+    parser = argparse.ArgumentParser(description="Measure embedding throughput and retry behaviour against the fake backend.")
+    parser.add_argument("--chunks", type=int, default=20000)
+    parser.add_argument("--chunk-chars", type=int, default=1000)
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--max-batch-tokens", type=int, default=50000)
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds per request")
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="share of requests answered with 429")
+    parser.add_argument("--server-errors", type=float, default=0.0, help="share of requests answered with 503")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    words = ["alpha", "beta", "gamma", "delta", "epsilon", "invoice", "report", "figure", "section", "revenue"]
+    texts = [" ".join(rng.choice(words) for _ in range(args.chunk_chars // 7)) + f" #{i}" for i in range(args.chunks)]
+
+    backend = FakeEmbeddings(dimension=args.dim, latency=args.latency, rate_limit=args.rate_limit,
+                             server_errors=args.server_errors, seed=args.seed)
+    client = BatchedEmbeddings(backend, max_batch_tokens=args.max_batch_tokens, max_concurrency=args.concurrency,
+                               backoff_base=0.05, backoff_max=1.0)
+    start = time.perf_counter()
+    vectors = client.embed_documents(texts)
+    elapsed = time.perf_counter() - start
+
+    assert vectors == [backend.vector(text) for text in texts], "vectors out of order"
+    stats = client.stats()
+    print(f"{len(texts)} chunks, {stats['tokens']} tokens in {elapsed:.2f}s "
+          f"({len(texts) / elapsed:.0f} chunks/s, {stats['tokens'] / elapsed:.0f} tokens/s)")
+    print(f"{stats['requests']} requests, {stats['retries']} retries, {stats['rate_limited']} rate-limited")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+## summary of the code below ##
+## Offline stand-in for AzureChatOpenAI, used with LLM_BACKEND=fake and by benchmark.py.
+## It supports the calls api.py makes (invoke, stream and batch) and answers with words derived from a hash of the
+## prompt, so the same prompt always gets the same answer. A fixed delay before the first token and a per-token
+## delay stand in for model latency.
+#################
+
+import hashlib
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+_WORDS = ("the", "document", "states", "that", "revenue", "grew", "in", "section", "figure", "shows", "a", "report",
+          "of", "results", "and", "summary", "for", "each", "quarter", "with", "notes")
+
+
+class FakeMessage:
+    def __init__(self, content):
+        self.content = content
+
+
+class FakeChatModel:
+    def __init__(self, first_token_latency=0.0, token_latency=0.0, answer_tokens=64):
+        self.first_token_latency = first_token_latency
+        self.token_latency = token_latency
+        self.answer_tokens = answer_tokens
+
+    def _tokens(self, prompt):
+        seed = int.from_bytes(hashlib.sha256(str(prompt).encode("utf-8")).digest()[:8], "little")
+        rng = random.Random(seed)
+        return [rng.choice(_WORDS) + " " for _ in range(self.answer_tokens)]
+
+    def invoke(self, prompt):
+        tokens = self._tokens(prompt)
+        time.sleep(self.first_token_latency + self.token_latency * len(tokens))
+        return FakeMessage("".join(tokens).strip())
+
+    def stream(self, prompt):
+        time.sleep(self.first_token_latency)
+        for token in self._tokens(prompt):
+            if self.token_latency:
+                time.sleep(self.token_latency)
+            yield FakeMessage(token)
+
+    def batch(self, prompts, config=None, return_exceptions=False):
+        # Same signature as LangChain's Runnable.batch; only max_concurrency is read from the config
+        workers = max(1, min(len(prompts), (config or {}).get("max_concurrency") or 8))
+
+        def call(prompt):
+            try:
+                return self.invoke(prompt)
+            except Exception as e:
+                if not return_exceptions:
+                    raise
+                return e
+
+        if not prompts:
+            return []
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            return list(pool.map(call, prompts))
@@ -3,19 +3,13 @@ import threading
 from flask import Flask, request, jsonify
 import os
 from io import BytesIO
-import numpy as np
-import faiss
-from bs4 import BeautifulSoup
 import requests
-from langchain.schema import Document
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_openai import AzureOpenAIEmbeddings, AzureChatOpenAI
-import pandas as pd
-from docx import Document as DocxDocument
-from pptx import Presentation
-import fitz  # PyMuPDF for PDF processing
+from langchain_openai import AzureChatOpenAI
 from dotenv import load_dotenv
 import logging
+import backends
+from chunking import chunk_segments
+from parsers import registry as parsers
 import streamlit as st
 import requests
 from io import BytesIO
@@ -31,10 +25,6 @@ CORS(api)  # Enable CORS for all routes
 load_dotenv()
 
 
-# Global variables
-documents = []
-faiss_index = None
-
 # Load environment variables
 os.environ["AZURE_OPENAI_API_KEY"] = os.getenv("AZURE_OPENAI_API_KEY_GPT4")
 # Add additional environment variables as needed
@@ -48,14 +38,11 @@ llm = AzureChatOpenAI(
     temperature=0.0,
 )
 
-os.environ["AZURE_OPENAI_API_KEY"] = os.getenv("AZURE_OPENAI_API_KEY_EMBEDDING")
-os.environ["AZURE_OPENAI_ENDPOINT"] = os.getenv("AZURE_OPENAI_ENDPOINT_EMBEDDING")
-os.environ["AZURE_OPENAI_API_VERSION"] = os.getenv("AZURE_OPENAI_API_VERSION_EMBEDDING")
+# Embeddings (batched, cached, or fake with EMBEDDING_BACKEND=fake) and the store are built as in api.py
+embeddings, embedding_client, embedding_cache = backends.embedding_backend()
 
-embeddings = AzureOpenAIEmbeddings(
-    azure_deployment=os.getenv("AZURE_EMBEDDING_NAME"),
-    openai_api_version=os.getenv("AZURE_OPENAI_API_VERSION_EMBEDDING")
-)
+# Document store: chunks and their FAISS rows, updated incrementally per source
+store = backends.make_store(embeddings)
 
 # Function to run Flask app
 def run_flask():
@@ -69,7 +56,7 @@ st.title("DocsTalk: Talk to your documents")
 
 # File upload section
 st.header("Upload Documents")
-uploaded_files = st.file_uploader("Choose files", accept_multiple_files=True, type=['txt', 'docx', 'xlsx', 'pptx', 'pdf'])
+uploaded_files = st.file_uploader("Choose files", accept_multiple_files=True, type=[ext[1:] for ext in parsers.extensions()])
 
 if uploaded_files:
     for file in uploaded_files:
@@ -116,7 +103,6 @@ if st.button("Get Answer"):
 
 @api.route('/upload', methods=['POST'])
 def upload_file():
-    global documents, faiss_index
     logger.info("Received file upload request.")
     if 'file' not in request.files:
         return jsonify({"error": "No file part"}), 400
@@ -130,33 +116,12 @@ def upload_file():
         file_extension = os.path.splitext(file.filename)[1].lower()
         logger.info(f"Processing file: {file.filename} with extension: {file_extension}")
 
-        # Process different file types
-        new_docs = []
-        if file_extension == '.txt':
-            new_docs = process_text(content.decode('utf-8'), file.filename)
-        elif file_extension == '.docx':
-            doc = DocxDocument(BytesIO(content))
-            text = "\n".join([para.text for para in doc.paragraphs if para.text])
-            new_docs = process_text(text, file.filename)
-        elif file_extension == '.xlsx':
-            df = pd.read_excel(BytesIO(content))
-            text = df.to_string(index=False)
-            new_docs = process_text(text, file.filename)
-        elif file_extension == '.pptx':
-            prs = Presentation(BytesIO(content))
-            text = ""
-            for slide in prs.slides:
-                for shape in slide.shapes:
-                    if hasattr(shape, "text") and shape.text:
-                        text += shape.text + "\n"
-            new_docs = process_text(text, file.filename)
-        elif file_extension == '.pdf':
-            new_docs = process_pdf(content, file.filename)
-        else:
+        # Parsed by the format's registered parser (see parsers.py)
+        if file_extension not in parsers.extensions():
             return jsonify({"error": f"Unsupported file type: {file_extension}"}), 400
+        new_docs = process_file(content, file.filename)
 
-        documents.extend(new_docs)
-        update_faiss_index()
+        store.replace_source(file.filename, new_docs)
         logger.info(f"Successfully processed {file.filename}.")
         return jsonify({"message": "File processed successfully"}), 200
 
@@ -166,9 +131,9 @@ def upload_file():
 
 @api.route('/process_urls', methods=['POST'])
 def process_urls():
-    global documents, faiss_index
     urls = request.json.get('urls', [])
     errors = []
+    docs_by_url = {}
 
     for url in urls:
         if not url.startswith(('http://', 'https://')):
@@ -178,46 +143,34 @@ def process_urls():
         try:
             response = requests.get(url)
             if response.status_code == 200:
-                text_content = response.text
-                new_docs = process_text(text_content, url)
-                documents.extend(new_docs)
+                docs_by_url[url] = process_file(response.content, url, response.headers.get("Content-Type"), fallback="html")
             else:
                 errors.append(f"Error fetching URL '{url}': Status code {response.status_code}.")
         except Exception as e:
             errors.append(f"Error processing URL '{url}': {str(e)}")
 
-    update_faiss_index()
+    if docs_by_url:
+        store.replace_sources(docs_by_url)
 
     if errors:
         return jsonify({"error": errors}), 400
 
     return jsonify({"message": "URLs processed successfully."}), 200
 
-def update_faiss_index():
-    global faiss_index
-    if documents:
-        embeddings_matrix = np.array(embeddings.embed_documents([doc.page_content for doc in documents]))
-        embedding_dimension = embeddings_matrix.shape[1]
-        faiss_index = faiss.IndexFlatL2(embedding_dimension)
-        faiss_index.add(embeddings_matrix)
-        logger.info("FAISS index updated.")
-
 @api.route('/ask', methods=['POST'])
 def ask_question():
-    global documents, faiss_index
     question = request.json.get('question', '')
     logger.info(f"Received question: {question}")
 
     if not question:
         return jsonify({"error": "No question provided"}), 400
 
-    if not documents:
+    if not len(store):
         response = llm.invoke(question)
         return jsonify({"answer": str(response.content)}), 200
 
     question_embedding = embeddings.embed_query(question)
-    distances, indices = faiss_index.search(np.array([question_embedding]), k=5)
-    relevant_docs = [documents[i] for i in indices[0]]
+    relevant_docs = store.search(question_embedding, k=5)
 
     context = " ".join([doc.page_content for doc in relevant_docs])
     sources = [doc.metadata["source"] for doc in relevant_docs]
@@ -236,18 +189,10 @@ def ask_question():
     logger.info("Question processed and answer generated.")
     return jsonify({"answer": str(response.content)}), 200
 
-def process_text(text, source, chunk_size=1000, chunk_overlap=200):
-    text_splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
-    chunks = text_splitter.split_text(text)
-    return [Document(page_content=chunk, metadata={"source": source}) for chunk in chunks]
-
-def process_pdf(content, filename, chunk_size=1000, chunk_overlap=200):
-    doc = fitz.open(stream=content, filetype="pdf")
-    concatenated_content = ""
-    for page in doc:
-        concatenated_content += page.get_text()
-    doc.close()
-    return process_text(concatenated_content, filename, chunk_size, chunk_overlap)
+def process_file(content, source, mime_type=None, chunk_size=1000, chunk_overlap=200, fallback=None):
+    # fallback: parser for content no parser matches; web pages of any type are read as HTML/text
+    segments = parsers.segments(content, source, mime_type, fallback=fallback)
+    return list(chunk_segments(segments, source, chunk_size, chunk_overlap))
 
 if __name__ == '__main__':
     pass
\ No newline at end of file
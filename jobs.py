@@ -0,0 +1,221 @@
+## summary of the code below ##
+## Background ingestion pipeline for /upload and /process_urls.
+## An endpoint submits a job and returns its id at once. A pool of parse workers turns the job payload into
+## chunks per source, a pool of embed workers embeds the chunks in batches, and a single committer applies the
+## finished job to the VectorStore. Queries keep using the last committed index until a job is committed.
+## A job can target its own store and commit lock, e.g. a named collection (see collection_manager.py).
+## Job progress (status, chunk counts, errors) is reported through IngestionQueue.status(job_id). With a status_dir
+## shared by several API processes, a job's progress can be read from any of them, not only the one running it.
+## Each job also reports how long its stages took (parse, split, embed, index, ...), see metrics.py.
+#################
+
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from metrics import Counter, record, recording, span
+
+logger = logging.getLogger(__name__)
+
+QUEUED, PARSING, EMBEDDING, COMMITTING, DONE, FAILED = "queued", "parsing", "embedding", "committing", "done", "failed"
+
+chunks_ingested = Counter("docstalk_chunks_ingested_total", "Chunks committed to the index by ingestion jobs.")
+
+
+class Job:
+    def __init__(self, kind, description, parse, on_commit=None, store=None, commit_lock=None, collection=None):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.description = description
+        # Callable returning ({source: [Document, ...]}, [error, ...])
+        self.parse = parse
+        # Optional callable run after this job's chunks are committed
+        self.on_commit = on_commit
+        # Store the chunks go to, the lock its writers take, and its collection name for status reports
+        self.store = store
+        self.commit_lock = commit_lock
+        self.collection = collection
+        self.status = QUEUED
+        self.sources = []
+        self.errors = []
+        self.chunks_total = 0
+        self.chunks_embedded = 0
+        self.chunks_added = 0
+        self.chunks_replaced = 0
+        self.created = time.time()
+        self.finished = None
+        # Milliseconds per stage; embed_ms adds up the batches, which run in parallel
+        self.timings = {}
+        self.docs_by_source = None
+        self.batches = []
+        self.vectors = []
+        self.pending = 0
+
+    def to_dict(self):
+        return {
+            "job_id": self.id,
+            "kind": self.kind,
+            "description": self.description,
+            "collection": self.collection,
+            "status": self.status,
+            "sources": self.sources,
+            "chunks_total": self.chunks_total,
+            "chunks_embedded": self.chunks_embedded,
+            "chunks_added": self.chunks_added,
+            "chunks_replaced": self.chunks_replaced,
+            "errors": self.errors,
+            "created": self.created,
+            "finished": self.finished,
+            "timings": dict(self.timings),
+        }
+
+
+class IngestionQueue:
+    def __init__(self, store, parse_workers=2, embed_workers=4, batch_size=256, on_commit=None, history=1000,
+                 commit_lock=None, status_dir=None):
+        self.store = store
+        self.batch_size = batch_size
+        self.on_commit = on_commit
+        self.history = history
+        self.status_dir = status_dir
+        if status_dir:
+            os.makedirs(status_dir, exist_ok=True)
+        self.parse_pool = ThreadPoolExecutor(max_workers=parse_workers, thread_name_prefix="parse")
+        self.embed_pool = ThreadPoolExecutor(max_workers=embed_workers, thread_name_prefix="embed")
+        # One writer at a time; also taken by synchronous writers such as /delete. Processes sharing a snapshot
+        # directory pass a snapshot.SnapshotWriter so their commits take turns too.
+        self.commit_lock = commit_lock or threading.Lock()
+        self.lock = threading.Lock()
+        self.status_lock = threading.Lock()
+        self.jobs = OrderedDict()
+
+    def submit(self, kind, description, parse, on_commit=None, store=None, commit_lock=None, collection=None):
+        # store and commit_lock default to the queue's own
+        job = Job(kind, description, parse, on_commit, self.store if store is None else store,
+                  self.commit_lock if commit_lock is None else commit_lock, collection)
+        with self.lock:
+            self.jobs[job.id] = job
+            while len(self.jobs) > self.history:
+                _, old = self.jobs.popitem(last=False)
+                self._remove_status(old)
+        self._save_status(job)
+        self.parse_pool.submit(self._run, self._parse, job)
+        logger.info(f"Queued {kind} job {job.id} for {description}.")
+        return job
+
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def in_flight(self):
+        with self.lock:
+            return sum(job.status not in (DONE, FAILED) for job in self.jobs.values())
+
+    def status(self, job_id):
+        job = self.get(job_id)
+        if job is not None:
+            return job.to_dict()
+        if not self.status_dir or not all(c in "0123456789abcdef" for c in job_id):
+            return None
+        try:
+            with open(os.path.join(self.status_dir, f"{job_id}.json")) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _save_status(self, job):
+        if not self.status_dir:
+            return
+        # Serialized so a slow writer cannot replace a newer status with an older one
+        path = os.path.join(self.status_dir, f"{job.id}.json")
+        with self.status_lock:
+            with open(f"{path}.tmp", "w") as f:
+                json.dump(job.to_dict(), f)
+            os.replace(f"{path}.tmp", path)
+
+    def _remove_status(self, job):
+        if self.status_dir:
+            try:
+                os.remove(os.path.join(self.status_dir, f"{job.id}.json"))
+            except OSError:
+                pass
+
+    def _run(self, step, job, *args):
+        try:
+            step(job, *args)
+        except Exception as e:
+            logger.exception(f"Ingestion job {job.id} failed.")
+            job.errors.append(str(e))
+            job.status = FAILED
+            job.finished = time.time()
+            job.docs_by_source = job.batches = job.vectors = None
+            self._save_status(job)
+
+    def _parse(self, job):
+        job.status = PARSING
+        self._save_status(job)
+        with recording(job.timings):
+            job.docs_by_source, errors = job.parse()
+        job.errors.extend(errors)
+        job.sources = list(job.docs_by_source)
+        docs = [doc for source_docs in job.docs_by_source.values() for doc in source_docs]
+        job.chunks_total = len(docs)
+        job.batches = [docs[i:i + self.batch_size] for i in range(0, len(docs), self.batch_size)]
+        job.vectors = [None] * len(job.batches)
+        job.pending = len(job.batches)
+        if not job.sources:
+            job.status = FAILED if job.errors else DONE
+            job.finished = time.time()
+            self._save_status(job)
+            return
+        job.status = EMBEDDING
+        self._save_status(job)
+        if not job.batches:
+            self._run(self._commit, job)
+        for i in range(len(job.batches)):
+            self.embed_pool.submit(self._run, self._embed, job, i)
+
+    def _embed(self, job, i):
+        if job.status == FAILED:
+            return
+        start = time.perf_counter()
+        vectors = job.store.embed(job.batches[i])
+        with self.lock:
+            record("embed", time.perf_counter() - start, job.timings)
+            # Another batch of this job may have failed while this one was embedding
+            if job.status == FAILED:
+                return
+            job.vectors[i] = vectors
+            job.chunks_embedded += len(job.batches[i])
+            job.pending -= 1
+            last = job.pending == 0
+        self._save_status(job)
+        if last:
+            self._commit(job)
+
+    def _commit(self, job):
+        job.status = COMMITTING
+        self._save_status(job)
+        vectors = [v for v in job.vectors if v is not None]
+        with job.commit_lock, recording(job.timings):
+            with span("index"):
+                job.chunks_added, job.chunks_replaced = job.store.replace_sources(
+                    job.docs_by_source, vectors=np.concatenate(vectors) if vectors else None)
+            with span("snapshot"):
+                if self.on_commit is not None:
+                    self.on_commit()
+                if job.on_commit is not None:
+                    job.on_commit()
+        chunks_ingested.inc(job.chunks_added)
+        job.status = DONE
+        job.finished = time.time()
+        job.docs_by_source = job.batches = job.vectors = None
+        self._save_status(job)
+        logger.info(f"Committed job {job.id}: {job.chunks_added} chunks added, {job.chunks_replaced} replaced.")
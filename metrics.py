@@ -0,0 +1,188 @@
+## summary of the code below ##
+## Minimal in-process metrics in the Prometheus text exposition format, served by api.py at /metrics.
+## Counters, gauges and histograms take optional labels; a counter or gauge can also read its value from a
+## function at scrape time (e.g. the embedding cache's own hit counts). span() times one pipeline stage
+## (parse, split, embed, index, search, llm, ...) into the docstalk_stage_seconds histogram; inside a recording(dict)
+## block the milliseconds are also added to that dict, so a job or request can report its own timing breakdown.
+## Values are per process; under a multi-process server each worker is scraped on its own.
+#################
+
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Seconds; covers cache hits (sub-millisecond) up to long ingestion steps
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+_registry = []
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for value in labels.values())
+    return "{" + ",".join(f'{key}="{value}"' for key, value in zip(labels, escaped)) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, help, labelnames=(), value_fn=None):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        # Callable returning the current value, or {label values tuple: value} when the metric has labels
+        self.value_fn = value_fn
+        self.lock = threading.Lock()
+        self.values = {}
+        _registry.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def samples(self):
+        if self.value_fn is not None:
+            value = self.value_fn()
+            values = value if isinstance(value, dict) else {(): value}
+        else:
+            with self.lock:
+                values = dict(self.values)
+        return [("", dict(zip(self.labelnames, key)), value) for key, value in values.items()]
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        with self.lock:
+            self.values[self._key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets) + (float("inf"),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self.lock:
+            counts, total = self.values.get(key, ([0] * len(self.buckets), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self.values[key] = (counts, total + value)
+
+    def samples(self):
+        with self.lock:
+            values = {key: (list(counts), total) for key, (counts, total) in self.values.items()}
+        samples = []
+        for key, (counts, total) in values.items():
+            labels = dict(zip(self.labelnames, key))
+            for bound, count in zip(self.buckets, counts):
+                samples.append(("_bucket", {**labels, "le": _format_value(bound)}, count))
+            samples.append(("_sum", labels, total))
+            samples.append(("_count", labels, counts[-1]))
+        return samples
+
+
+def render():
+    lines = []
+    for metric in _registry:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        for suffix, labels, value in metric.samples():
+            lines.append(f"{metric.name}{suffix}{_format_labels(labels)} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
+
+
+def resident_memory_bytes():
+    # Current RSS from /proc on Linux; elsewhere the peak RSS reported by getrusage
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+        import sys
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+    except ImportError:
+        return 0
+
+
+stage_seconds = Histogram("docstalk_stage_seconds", "Time spent per pipeline stage.", ["stage"])
+
+_local = threading.local()
+
+
+@contextmanager
+def recording(timings):
+    # Stages timed by this thread inside the block are also added to timings, e.g. a job's or request's breakdown
+    previous = getattr(_local, "timings", None)
+    _local.timings = timings
+    try:
+        yield timings
+    finally:
+        _local.timings = previous
+
+
+def record(stage, seconds, timings=None):
+    stage_seconds.observe(seconds, stage=stage)
+    timings = timings if timings is not None else getattr(_local, "timings", None)
+    if timings is not None:
+        timings[f"{stage}_ms"] = round(timings.get(f"{stage}_ms", 0) + seconds * 1000, 1)
+
+
+@contextmanager
+def span(stage, timings=None):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(stage, time.perf_counter() - start, timings)
+
+
+class TimedIterator:
+    """Wraps an iterator and adds up the time spent producing its items (e.g. extracting PDF pages), excluding
+    the consumer's work in between."""
+
+    def __init__(self, iterable):
+        self.iterator = iter(iterable)
+        self.elapsed = 0.0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        start = time.perf_counter()
+        try:
+            return next(self.iterator)
+        finally:
+            self.elapsed += time.perf_counter() - start
@@ -0,0 +1,237 @@
+## summary of the code below ##
+## Parser registry: one place that maps file extensions and MIME types to document parsers.
+## Every parser has the same streaming interface: it takes the raw bytes of a document (or a path to it) and yields
+## (text, metadata) segments, e.g. one per PDF page or slide, which chunking.chunk_segments turns into chunks.
+## A parser's backend (PyMuPDF, python-docx, python-pptx, openpyxl, BeautifulSoup) is only imported the first time a
+## document of its type is parsed, so the server starts quickly and a worker only pays for the formats it sees.
+## The time each import took is kept and reported by stats() (and on /metrics in api.py).
+## Other formats can be plugged in with registry.register(), with a loader function or a "module:function" path.
+## Used by api.py, integrated.py and RAG_console.
+#################
+
+import importlib
+import logging
+import mimetypes
+import os
+import threading
+import time
+from io import BytesIO
+
+logger = logging.getLogger(__name__)
+
+
+def read_bytes(data):
+    # Parsers accept the document's bytes or a path to it
+    if isinstance(data, (bytes, bytearray)):
+        return bytes(data)
+    with open(data, "rb") as f:
+        return f.read()
+
+
+def as_file(data):
+    # File object or path for libraries that read either
+    return BytesIO(data) if isinstance(data, (bytes, bytearray)) else data
+
+
+class Parser:
+    def __init__(self, name, extensions, mime_types, loader, options=None):
+        self.name = name
+        self.extensions = tuple(extension.lower() for extension in extensions)
+        self.mime_types = tuple(mime_types)
+        # Callable returning the parse function, or "module:function" naming the parse function itself
+        self.loader = loader
+        # Keyword arguments passed to every parse call, e.g. PDF worker counts
+        self.options = dict(options or {})
+        self.parse = None
+        self.import_seconds = None
+        self.lock = threading.Lock()
+
+    def load(self):
+        with self.lock:
+            if self.parse is None:
+                start = time.perf_counter()
+                if isinstance(self.loader, str):
+                    module, _, function = self.loader.partition(":")
+                    self.parse = getattr(importlib.import_module(module), function)
+                else:
+                    self.parse = self.loader()
+                self.import_seconds = time.perf_counter() - start
+                logger.info(f"Loaded {self.name} parser in {self.import_seconds * 1000:.1f} ms.")
+            return self.parse
+
+    def segments(self, data):
+        return self.load()(data, **self.options)
+
+
+class ParserRegistry:
+    def __init__(self):
+        self.parsers = {}
+        self.by_extension = {}
+        self.by_mime_type = {}
+
+    def register(self, name, extensions=(), mime_types=(), loader=None, options=None):
+        # A later registration for the same extension or MIME type replaces the earlier one
+        parser = Parser(name, extensions, mime_types, loader, options)
+        self.parsers[name] = parser
+        for extension in parser.extensions:
+            self.by_extension[extension] = parser
+        for mime_type in parser.mime_types:
+            self.by_mime_type[mime_type] = parser
+        return parser
+
+    def configure(self, name, **options):
+        self.parsers[name].options.update(options)
+
+    def extensions(self):
+        return tuple(self.by_extension)
+
+    def find(self, filename=None, mime_type=None):
+        # A given MIME type (e.g. a Content-Type header) wins over the extension, which wins over a guessed type
+        if mime_type:
+            parser = self.by_mime_type.get(mime_type.split(";")[0].strip().lower())
+            if parser is not None:
+                return parser
+        if filename:
+            parser = self.by_extension.get(os.path.splitext(filename)[1].lower())
+            if parser is not None:
+                return parser
+            guessed = mimetypes.guess_type(filename)[0]
+            if guessed:
+                return self.by_mime_type.get(guessed)
+        return None
+
+    def segments(self, data, filename=None, mime_type=None, fallback=None):
+        # Yields (text, metadata) segments of the document; data is its bytes or a path.
+        # fallback names the parser for documents no parser matches, e.g. "html" for web pages of any type.
+        parser = self.find(filename, mime_type)
+        if parser is None and fallback is not None:
+            parser = self.parsers[fallback]
+        if parser is None:
+            raise ValueError(f"Unsupported file type: {os.path.splitext(filename or '')[1].lower() or mime_type}")
+        return parser.segments(data)
+
+    def stats(self):
+        return {
+            name: {"loaded": parser.parse is not None, "import_seconds": parser.import_seconds,
+                   "extensions": list(parser.extensions)}
+            for name, parser in self.parsers.items()
+        }
+
+
+def _load_text():
+    def parse(data, encoding="utf-8"):
+        yield read_bytes(data).decode(encoding), {}
+    return parse
+
+
+def _load_docx():
+    from docx import Document as DocxDocument
+
+    def parse(data):
+        for paragraph in DocxDocument(as_file(data)).paragraphs:
+            if paragraph.text:
+                yield paragraph.text + "\n", {}
+    return parse
+
+
+def _cell_text(value):
+    if value is None:
+        return ""
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return " ".join(str(value).split())
+
+
+def _load_xlsx():
+    from openpyxl import load_workbook
+
+    def parse(data, chunk_size=1000):
+        # Streams every sheet row by row (read-only mode keeps memory flat) and yields groups of rows, each headed by
+        # its sheet, row range and the sheet's header row, so a chunk keeps the column names. A group fits in
+        # chunk_size characters (the chunker's), so the chunker never splits one and loses its header; a row too long
+        # for a group on its own is cut into several groups of that one row.
+        # Cells are joined with " | " instead of padded to fixed-width columns.
+        workbook = load_workbook(as_file(data), read_only=True, data_only=True)
+        try:
+            for sheet in workbook.worksheets:
+                header = None
+                rows = []
+                size = 0
+                first_row = None
+                for number, values in enumerate(sheet.iter_rows(values_only=True), start=1):
+                    cells = [_cell_text(value) for value in values]
+                    while cells and not cells[-1]:
+                        cells.pop()
+                    if not cells:
+                        continue
+                    line = " | ".join(cells)
+                    if header is None:
+                        # Repeated in every group, so a very wide header is cut to leave room for the rows
+                        header = line[:chunk_size // 2]
+                        continue
+                    if rows and _group_size(sheet.title, header, first_row, number, size + len(line)) > chunk_size:
+                        yield _row_group(sheet.title, header, rows, first_row, last_row)
+                        rows, size = [], 0
+                    if not rows:
+                        first_row = number
+                        room = max(1, chunk_size - _group_size(sheet.title, header, number, number, 0))
+                        while len(line) > room:
+                            yield _row_group(sheet.title, header, [line[:room]], number, number)
+                            line = line[room:]
+                    rows.append(line)
+                    size += len(line) + 1
+                    last_row = number
+                if rows:
+                    yield _row_group(sheet.title, header, rows, first_row, last_row)
+                elif header is not None:
+                    # A sheet with a single row
+                    yield f"Sheet {sheet.title}\n{header}\n\n", {"sheet": sheet.title}
+        finally:
+            workbook.close()
+    return parse
+
+
+def _row_group(sheet, header, rows, first_row, last_row):
+    text = f"Sheet {sheet}, rows {first_row}-{last_row}\n{header}\n" + "\n".join(rows) + "\n\n"
+    return text, {"sheet": sheet, "row_start": first_row, "row_end": last_row}
+
+
+def _group_size(sheet, header, first_row, last_row, rows_size):
+    # Length of the _row_group text for rows taking rows_size characters with their newlines
+    return len(f"Sheet {sheet}, rows {first_row}-{last_row}\n{header}\n") + rows_size + 2
+
+
+def _load_pptx():
+    from pptx import Presentation
+
+    def parse(data):
+        for number, slide in enumerate(Presentation(as_file(data)).slides, start=1):
+            text = "".join(shape.text + "\n" for shape in slide.shapes if hasattr(shape, "text") and shape.text)
+            yield text, {"slide": number}
+    return parse
+
+
+def _load_pdf():
+    from pdf_extract import stream_pdf_pages
+
+    def parse(data, workers=None, parallel_pages=64):
+        return stream_pdf_pages(data, workers=workers, parallel_pages=parallel_pages)
+    return parse
+
+
+def _load_html():
+    from bs4 import BeautifulSoup
+
+    def parse(data):
+        yield BeautifulSoup(read_bytes(data), "html.parser").get_text(), {}
+    return parse
+
+
+registry = ParserRegistry()
+registry.register("text", [".txt"], ["text/plain"], _load_text)
+registry.register("docx", [".docx"], ["application/vnd.openxmlformats-officedocument.wordprocessingml.document"], _load_docx)
+registry.register("xlsx", [".xlsx"], ["application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"], _load_xlsx)
+registry.register("pptx", [".pptx"], ["application/vnd.openxmlformats-officedocument.presentationml.presentation"], _load_pptx)
+registry.register("pdf", [".pdf"], ["application/pdf"], _load_pdf)
+# Web pages from /process_urls; not offered for uploads
+registry.register("html", [], ["text/html", "application/xhtml+xml"], _load_html)
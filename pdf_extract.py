@@ -0,0 +1,75 @@
+## summary of the code below ##
+## Streaming PDF text extraction. stream_pdf_pages() yields (page text, {"page": n}) one page at a time, so callers
+## can feed pages straight into chunking.chunk_segments instead of concatenating the whole document.
+## Documents with at least parallel_pages pages are split into page ranges and extracted by a process pool;
+## only a bounded number of ranges are in flight, so peak memory follows a window of pages, not the document.
+#################
+
+import os
+import tempfile
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import fitz  # PyMuPDF for PDF processing
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _process_pool(workers):
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=workers)
+        return _pool
+
+
+def _open(pdf):
+    # pdf is either a path or the raw bytes of the file
+    if isinstance(pdf, (bytes, bytearray)):
+        return fitz.open(stream=pdf, filetype="pdf")
+    return fitz.open(pdf)
+
+
+def _extract_range(path, start, stop):
+    doc = fitz.open(path)
+    try:
+        return [doc[i].get_text() for i in range(start, stop)]
+    finally:
+        doc.close()
+
+
+def stream_pdf_pages(pdf, workers=None, parallel_pages=64, pages_per_task=16):
+    workers = workers or os.cpu_count() or 1
+    doc = _open(pdf)
+    try:
+        page_count = doc.page_count
+        if workers < 2 or page_count < parallel_pages:
+            for i in range(page_count):
+                yield doc[i].get_text(), {"page": i + 1}
+            return
+    finally:
+        doc.close()
+
+    # Workers open the file themselves; uploaded bytes are written to a temporary file once instead of
+    # being pickled into every task
+    path = pdf
+    if isinstance(pdf, (bytes, bytearray)):
+        fd, path = tempfile.mkstemp(suffix=".pdf")
+        with os.fdopen(fd, "wb") as f:
+            f.write(pdf)
+    try:
+        pool = _process_pool(workers)
+        ranges = deque((start, min(start + pages_per_task, page_count)) for start in range(0, page_count, pages_per_task))
+        in_flight = deque()
+        while ranges or in_flight:
+            while ranges and len(in_flight) < 2 * workers:
+                start, stop = ranges.popleft()
+                in_flight.append((start, pool.submit(_extract_range, path, start, stop)))
+            start, future = in_flight.popleft()
+            for offset, text in enumerate(future.result()):
+                yield text, {"page": start + offset + 1}
+    finally:
+        if path is not pdf:
+            os.remove(path)
@@ -0,0 +1,168 @@
+## summary of the code below ##
+## Snapshots persist a VectorStore (FAISS index, chunk texts and chunk metadata) so a restart does not re-ingest.
+## Each save writes a new numbered version directory and then atomically repoints the CURRENT file at it:
+##   index.faiss      the FAISS index
+##   texts.bin        every chunk's UTF-8 text, concatenated
+##   offsets.npy      int64 byte offsets into texts.bin, one more than the number of chunks
+##   source_ids.npy   int32 per-chunk index into the "sources" table of meta.json
+##   pages.npy        int32 page number per chunk, -1 for sources without pages
+##   spans.npy        int64 (start, end) character offsets of each chunk in its source, -1 when unknown
+##   metadata.bin     per-chunk JSON of any other metadata (offsets in metadata_offsets.npy)
+##   hashes.json      content hash of each uploaded source, to recognize unchanged re-uploads
+##   vectors.npy      full-precision vectors, only when the index stores compressed codes
+## Loading memory-maps all of these, so startup time and RSS do not grow with the corpus, and several worker
+## processes on one host share the same page-cache copy. These are the arrays of a ChunkStore (see chunk_store.py),
+## so chunks become Document objects only when accessed.
+## Several API processes can share one directory: SnapshotWriter makes their changes take turns, each on top of the
+## latest version, and refresh_snapshot() lets readers pick up versions saved by the other processes.
+#################
+
+import json
+import logging
+import os
+import shutil
+import threading
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+import faiss
+
+from chunk_store import ChunkStore
+from vector_file import VectorFile
+
+logger = logging.getLogger(__name__)
+
+# Versions kept on disk besides the current one, so workers still reading an older version are not cut off
+KEEP_VERSIONS = 2
+
+# Read the index without copying it into the heap; IO_FLAG_MMAP_IFC only exists in newer faiss releases
+MMAP_FLAGS = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP) | faiss.IO_FLAG_READ_ONLY
+
+
+def current_version(directory):
+    try:
+        with open(os.path.join(directory, "CURRENT")) as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        return None
+
+
+def save_snapshot(store, directory):
+    # Saves the state that is current when called; later swaps do not affect a save in progress
+    state = store.state
+    os.makedirs(directory, exist_ok=True)
+    previous = current_version(directory)
+    number = int(previous[1:]) + 1 if previous else 1
+    version = f"v{number:08d}"
+    path = os.path.join(directory, version)
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+
+    sources = state.chunks.save(tmp_path)
+    if state.index is not None:
+        faiss.write_index(state.index, os.path.join(tmp_path, "index.faiss"))
+    if state.vectors is not None:
+        state.vectors.save(os.path.join(tmp_path, "vectors.npy"), len(state.chunks))
+    with open(os.path.join(tmp_path, "meta.json"), "w") as f:
+        json.dump({"count": len(state.chunks), "sources": sources}, f)
+
+    # The version directory appears under its final name only once complete, and CURRENT is swapped atomically
+    os.rename(tmp_path, path)
+    with open(os.path.join(directory, "CURRENT.tmp"), "w") as f:
+        f.write(version)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(os.path.join(directory, "CURRENT.tmp"), os.path.join(directory, "CURRENT"))
+    if store.state is state:
+        store.snapshot_version = version
+        store.snapshot_state_version = state.version
+    store.saved_vectors = (version, state.vectors) if state.vectors is not None and not state.vectors.readonly else None
+    logger.info(f"Saved snapshot {version} with {len(state.chunks)} chunks.")
+
+    versions = sorted(name for name in os.listdir(directory) if name.startswith("v") and "." not in name)
+    for name in versions[:-(KEEP_VERSIONS + 1)]:
+        shutil.rmtree(os.path.join(directory, name), ignore_errors=True)
+    return version
+
+
+def load_snapshot(store, directory):
+    version = current_version(directory)
+    if version is None:
+        logger.info(f"No snapshot found in {directory}.")
+        return None
+    path = os.path.join(directory, version)
+    with open(os.path.join(path, "meta.json")) as f:
+        meta = json.load(f)
+    if meta["count"]:
+        index = faiss.read_index(os.path.join(path, "index.faiss"), MMAP_FLAGS)
+        chunks = ChunkStore.load(path, meta["sources"])
+        vectors_path = os.path.join(path, "vectors.npy")
+        if store.saved_vectors is not None and store.saved_vectors[0] == version:
+            # Written by this process, whose file holds the same rows and can still be appended to
+            vectors = store.saved_vectors[1]
+        else:
+            vectors = VectorFile.load(vectors_path) if os.path.exists(vectors_path) else None
+    else:
+        index, chunks, vectors = None, ChunkStore(), None
+    with store.write_lock:
+        state = store.swap(index, chunks, vectors, mapped=index is not None)
+        store.snapshot_version = version
+        store.snapshot_state_version = state.version
+    logger.info(f"Loaded snapshot {version} with {meta['count']} chunks.")
+    return version
+
+
+def refresh_snapshot(store, directory, blocking=True):
+    # Picks up a version saved by another process (e.g. another API worker); cheap when nothing changed.
+    # Non-blocking callers skip the check while this process is writing, instead of waiting for it.
+    if not store.write_lock.acquire(blocking=blocking):
+        return None
+    try:
+        version = current_version(directory)
+        if version is None or version == store.snapshot_version:
+            return None
+        return load_snapshot(store, directory)
+    finally:
+        store.write_lock.release()
+
+
+class SnapshotWriter:
+    """Serializes changes to a store that is shared with other processes through a snapshot directory.
+
+    Entering takes this process's lock and an exclusive lock file in the directory, then loads any version another
+    process saved meanwhile, so every change is applied on top of the latest snapshot and none is lost.
+    Without fcntl (Windows) only the in-process lock is taken.
+    """
+
+    def __init__(self, store, directory):
+        self.store = store
+        self.directory = directory
+        self.lock = threading.Lock()
+        self.lock_file = None
+
+    def __enter__(self):
+        self.lock.acquire()
+        try:
+            if fcntl is not None:
+                os.makedirs(self.directory, exist_ok=True)
+                self.lock_file = open(os.path.join(self.directory, "LOCK"), "a")
+                fcntl.flock(self.lock_file, fcntl.LOCK_EX)
+            refresh_snapshot(self.store, self.directory)
+        except BaseException:
+            self._release()
+            raise
+        return self
+
+    def __exit__(self, *exc_info):
+        self._release()
+
+    def _release(self):
+        if self.lock_file is not None:
+            fcntl.flock(self.lock_file, fcntl.LOCK_UN)
+            self.lock_file.close()
+            self.lock_file = None
+        self.lock.release()
@@ -0,0 +1,111 @@
+## summary of the code below ##
+## UrlFetcher downloads batches of URLs concurrently for /process_urls.
+## Requests go through one pooled keep-alive requests.Session, with a bound on in-flight requests per host and
+## connect/read timeouts, so one slow host cannot hold up the whole batch.
+## ETag / Last-Modified values and a hash of the body are remembered per collection and URL (the same page can be
+## indexed in several collections, each refreshed on its own schedule); re-submitted URLs are fetched with
+## conditional GETs, and pages that come back 304 or with an identical body are reported as unchanged so they are
+## neither re-parsed nor re-embedded. Validators are only remembered once the caller commits the page to the index.
+#################
+
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+CHANGED, UNCHANGED, ERROR = "changed", "unchanged", "error"
+
+# Collection of callers that do not name one; same name as collection_manager.DEFAULT_COLLECTION
+DEFAULT_COLLECTION = "default"
+
+
+class FetchResult:
+    def __init__(self, url, status, text=None, error=None, validators=None):
+        self.url = url
+        self.status = status
+        self.text = text
+        self.error = error
+        self.validators = validators
+
+
+class UrlFetcher:
+    def __init__(self, max_workers=8, per_host=2, connect_timeout=5, read_timeout=30, verify=False,
+                 validators_path=None, session=None):
+        self.per_host = per_host
+        self.timeout = (connect_timeout, read_timeout)
+        self.verify = verify
+        self.validators_path = validators_path
+        self.session = session or requests.Session()
+        adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="fetch")
+        self.lock = threading.Lock()
+        self.host_slots = defaultdict(lambda: threading.Semaphore(self.per_host))
+        # {collection: {url: validators}}
+        self.validators = {}
+        if validators_path and os.path.exists(validators_path):
+            with open(validators_path) as f:
+                self.validators = json.load(f)
+            if any("sha256" in value for value in self.validators.values()):
+                # Files written before collections existed hold the default collection's URLs only
+                self.validators = {DEFAULT_COLLECTION: self.validators}
+
+    def fetch_all(self, urls, is_indexed=lambda url: True, collection=DEFAULT_COLLECTION):
+        # is_indexed(url) tells whether the collection's index still holds the page; otherwise it is fetched
+        # unconditionally
+        return list(self.pool.map(lambda url: self.fetch(url, is_indexed(url), collection), urls))
+
+    def fetch(self, url, conditional=True, collection=DEFAULT_COLLECTION):
+        with self.lock:
+            known = dict(self.validators.get(collection, {}).get(url, {})) if conditional else {}
+            slot = self.host_slots[urlsplit(url).netloc]
+        headers = {}
+        if known.get("etag"):
+            headers["If-None-Match"] = known["etag"]
+        if known.get("last_modified"):
+            headers["If-Modified-Since"] = known["last_modified"]
+
+        try:
+            with slot:
+                response = self.session.get(url, headers=headers, timeout=self.timeout, verify=self.verify)
+        except Exception as e:
+            return FetchResult(url, ERROR, error=f"Error processing URL '{url}': {str(e)}")
+
+        if response.status_code == 304 and known:
+            logger.info(f"{url} not modified.")
+            return FetchResult(url, UNCHANGED)
+        if response.status_code != 200:
+            return FetchResult(url, ERROR, error=f"Error fetching URL '{url}': Status code {response.status_code}.")
+
+        digest = hashlib.sha256(response.content).hexdigest()
+        validators = {
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+            "sha256": digest,
+        }
+        if known.get("sha256") == digest:
+            logger.info(f"{url} unchanged.")
+            self.remember({url: validators}, collection)
+            return FetchResult(url, UNCHANGED)
+        return FetchResult(url, CHANGED, text=response.text, validators=validators)
+
+    def remember(self, validators_by_url, collection=DEFAULT_COLLECTION):
+        if not validators_by_url:
+            return
+        with self.lock:
+            self.validators.setdefault(collection, {}).update(validators_by_url)
+            if self.validators_path:
+                tmp_path = f"{self.validators_path}.tmp"
+                with open(tmp_path, "w") as f:
+                    json.dump(self.validators, f)
+                os.replace(tmp_path, self.validators_path)
@@ -0,0 +1,95 @@
+## summary of the code below ##
+## VectorFile holds full-precision float32 vectors in a memory-mapped file, row-aligned with the index and chunk list.
+## It backs compressed index storage (see ann_index.py): the index keeps only compact codes in RAM while exact
+## vectors stay on disk and are paged in to re-rank the top candidates or to rebuild the index.
+## Rows are only ever appended, never rewritten, so older store versions can keep reading a file that a newer
+## version extends; removals write the kept rows to a new file instead.
+#################
+
+import os
+import tempfile
+import weakref
+
+import numpy as np
+
+# Rows copied at a time, to keep memory bounded
+_COMPACT_BLOCK = 65536
+
+
+class VectorFile:
+    def __init__(self, dimension, directory=None):
+        fd, self.path = tempfile.mkstemp(prefix="docstalk-vectors-", suffix=".f32", dir=directory)
+        os.close(fd)
+        self.dimension = dimension
+        self.count = 0
+        self.readonly = False
+        self._map = None
+        # The temporary file goes away once no store version references it any more, or at exit
+        self._finalizer = weakref.finalize(self, _remove, self.path)
+
+    @classmethod
+    def load(cls, path):
+        # Read-only view of a matrix saved with save(); nothing is read until rows are accessed
+        vectors = cls.__new__(cls)
+        vectors._map = np.load(path, mmap_mode="r")
+        vectors.path = None
+        vectors._finalizer = None
+        vectors.dimension = vectors._map.shape[1]
+        vectors.count = vectors._map.shape[0]
+        vectors.readonly = True
+        return vectors
+
+    def __len__(self):
+        return self.count
+
+    @property
+    def matrix(self):
+        if self._map is None:
+            return np.zeros((0, self.dimension), dtype=np.float32)
+        return self._map[:self.count]
+
+    def rows(self, indices):
+        # Sorted access keeps reads sequential on disk; callers get rows back in their own order
+        indices = np.asarray(indices)
+        order = np.argsort(indices)
+        rows = np.empty((len(indices), self.dimension), dtype=np.float32)
+        rows[order] = self.matrix[indices[order]]
+        return rows
+
+    def append(self, vectors):
+        needed = self.count + len(vectors)
+        capacity = 0 if self._map is None else self._map.shape[0]
+        if capacity < needed:
+            capacity = max(needed, 2 * capacity, 1024)
+            if self._map is not None:
+                self._map.flush()
+            with open(self.path, "r+b") as f:
+                f.truncate(capacity * self.dimension * 4)
+            # Concurrent readers keep using the old mapping until the new one is assigned; both see the same rows
+            self._map = np.memmap(self.path, dtype=np.float32, mode="r+", shape=(capacity, self.dimension))
+        self._map[self.count:needed] = vectors
+        self.count = needed
+
+    def writable_copy(self, directory=None, mask=None):
+        # Copy of all rows, or only of the rows selected by a boolean mask
+        copy = VectorFile(self.dimension, directory)
+        rows = np.arange(self.count) if mask is None else np.flatnonzero(mask)
+        for start in range(0, len(rows), _COMPACT_BLOCK):
+            block = rows[start:start + _COMPACT_BLOCK]
+            copy.append(self.matrix[block[0]:block[-1] + 1] if mask is None else self.matrix[block])
+        return copy
+
+    def save(self, path, count=None):
+        np.save(path, self.matrix[:count])
+
+    def close(self):
+        self._map = None
+        if self._finalizer is not None:
+            self._finalizer()
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
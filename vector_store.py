@@ -0,0 +1,277 @@
+## summary of the code below ##
+## VectorStore keeps the FAISS index and the chunks row-aligned: row i of the index is chunk i of a ChunkStore
+## (see chunk_store.py), which keeps chunk text and metadata in flat arrays and builds Documents only for search hits.
+## New chunks are embedded once and appended to the index instead of re-embedding the whole corpus.
+## Chunks can be removed or replaced per source, so re-uploading a file does not duplicate its chunks.
+## Copy-on-write: the index, chunks and vectors of one version live in an immutable StoreState. Readers grab
+## store.state once and search it without locks; writers (serialized by write_lock) build the next state from
+## copies and swap it in with a single assignment, so a query never sees an index and chunk list that disagree.
+## A store loaded from a snapshot (see snapshot.py) is served from read-only memory maps until its first change.
+## The index type (flat, ivf, hnsw or auto) is configurable; see ann_index.py. Approximate indexes are rebuilt from
+## their stored vectors when chunks are removed, when auto mode crosses its threshold, or when IVF needs retraining.
+## With compressed storage (fp16, sq8 or pq) the index holds only codes; the full float32 vectors are kept in a
+## memory-mapped VectorFile and the top k * rerank_factor candidates are re-ranked by exact L2 distance.
+#################
+
+import logging
+import threading
+
+import numpy as np
+
+from ann_index import (INDEX_TYPES, STORAGE_TYPES, build_index, copy_index, index_bytes, index_kind, index_storage,
+                       index_vectors, needs_retrain, resolve_kind, resolve_storage, search_params)
+from chunk_store import ChunkStore
+from vector_file import VectorFile
+
+logger = logging.getLogger(__name__)
+
+
+class StoreState:
+    """One immutable version of the index, its row-aligned chunks and (for compressed storage) exact vectors."""
+
+    def __init__(self, index=None, chunks=None, vectors=None, version=0, rerank_factor=4, mapped=False):
+        self.index = index
+        # Whether the index is memory-mapped from a snapshot rather than owned in memory
+        self.mapped = mapped
+        self.chunks = ChunkStore() if chunks is None else chunks
+        # Full-precision vectors; only kept outside the index when the index stores compressed codes.
+        # Later versions may append rows to the same file, but never change the rows this version uses.
+        self.vectors = vectors
+        # Increases with every change of the indexed chunks, so caches of search results can tell they are stale
+        self.version = version
+        self.rerank_factor = rerank_factor
+        self._memory_bytes = None
+
+    def __len__(self):
+        return len(self.chunks)
+
+    def memory_bytes(self):
+        # Estimated size of this version (chunk arrays, index and exact vectors), e.g. for a memory budget
+        if self._memory_bytes is None:
+            size = self.chunks.nbytes() + index_bytes(self.index)
+            if self.vectors is not None:
+                size += len(self.chunks) * self.vectors.dimension * 4
+            self._memory_bytes = size
+        return self._memory_bytes
+
+    def sources(self):
+        return sorted(self.chunks.sources)
+
+    def search(self, query_embedding, k=5, nprobe=None, ef_search=None):
+        return self.search_many([query_embedding], k=k, nprobe=nprobe, ef_search=ef_search)[0]
+
+    def search_many(self, query_embeddings, k=5, nprobe=None, ef_search=None):
+        # One FAISS call for the whole batch of queries; returns a list of chunks per query
+        return [docs for docs, _ in self.retrieve_many(query_embeddings, k=k, nprobe=nprobe, ef_search=ef_search)]
+
+    def retrieve_many(self, query_embeddings, k=5, nprobe=None, ef_search=None):
+        # Like search_many, but also returns the vectors of the hits (one row per chunk), e.g. for MMR.
+        # They come from the same search call: exact vectors with compressed storage, otherwise the index's own.
+        queries = np.asarray(query_embeddings, dtype=np.float32).reshape(len(query_embeddings), -1)
+        if not len(self.chunks):
+            return [([], np.zeros((0, queries.shape[1]), dtype=np.float32)) for _ in range(len(queries))]
+        k = min(k, len(self.chunks))
+        params = search_params(self.index, nprobe=nprobe, ef_search=ef_search)
+        if self.vectors is None:
+            distances, indices, vectors = self.index.search_and_reconstruct(queries, k, params=params)
+            return [(self.chunks.documents(row[row >= 0]), row_vectors[row >= 0]) for row, row_vectors in zip(indices, vectors)]
+
+        # Over-fetch on the compressed codes, then re-rank the candidates by exact distance
+        fetch = min(k * self.rerank_factor, len(self.chunks))
+        distances, indices = self.index.search(queries, fetch, params=params)
+        results = []
+        for query, row in zip(queries, indices):
+            candidates = row[row >= 0]
+            exact_vectors = self.vectors.rows(candidates)
+            best = np.argsort(((exact_vectors - query) ** 2).sum(axis=1))[:k]
+            results.append((self.chunks.documents(candidates[best]), exact_vectors[best]))
+        return results
+
+
+class VectorStore:
+    def __init__(self, embeddings, index_type="flat", ann_threshold=50000, auto_index_type="ivf", nprobe=16, ef_search=64,
+                 storage="full", rerank_factor=4, vector_dir=None):
+        if index_type not in INDEX_TYPES or auto_index_type not in ("ivf", "hnsw"):
+            raise ValueError(f"Unsupported index type: {index_type} / {auto_index_type}")
+        if storage not in STORAGE_TYPES:
+            raise ValueError(f"Unsupported vector storage: {storage}")
+        self.embeddings = embeddings
+        self.index_type = index_type
+        self.ann_threshold = ann_threshold
+        self.auto_index_type = auto_index_type
+        self.nprobe = nprobe
+        self.ef_search = ef_search
+        self.storage = storage
+        self.rerank_factor = rerank_factor
+        self.vector_dir = vector_dir
+        self.state = StoreState(rerank_factor=rerank_factor)
+        self.write_lock = threading.RLock()
+        # Snapshot version (see snapshot.py) the current state was loaded from or saved as, and the StoreState.version
+        # it holds; a later state has unsaved changes
+        self.snapshot_version = None
+        self.snapshot_state_version = None
+        # (snapshot version, writable vector file) of the last save; loading that version again, e.g. when a paged-out
+        # collection comes back, keeps appending to this file instead of copying the snapshot's read-only one
+        self.saved_vectors = None
+
+    # Convenience views of the current state; code that makes several reads should grab self.state once
+    @property
+    def index(self):
+        return self.state.index
+
+    @property
+    def chunks(self):
+        return self.state.chunks
+
+    @property
+    def vectors(self):
+        return self.state.vectors
+
+    @property
+    def version(self):
+        return self.state.version
+
+    def __len__(self):
+        return len(self.state)
+
+    def sources(self):
+        return self.state.sources()
+
+    def unsaved(self):
+        return self.snapshot_state_version != self.state.version
+
+    def embed(self, docs):
+        if not docs:
+            return None
+        return np.asarray(self.embeddings.embed_documents([doc.page_content for doc in docs]), dtype=np.float32)
+
+    def target_kind(self, count):
+        return resolve_kind(self.index_type, count, self.ann_threshold, self.auto_index_type)
+
+    def _needs_rebuild(self, index, count):
+        return (index_kind(index) != self.target_kind(count)
+                or index_storage(index) != resolve_storage(self.storage, count)
+                or needs_retrain(index, count))
+
+    def _build(self, vectors):
+        if not len(vectors):
+            return None
+        kind = self.target_kind(len(vectors))
+        logger.info(f"Building {kind} FAISS index with {resolve_storage(self.storage, len(vectors))} storage over {len(vectors)} vectors.")
+        return build_index(kind, vectors, nprobe=self.nprobe, ef_search=self.ef_search, storage=self.storage)
+
+    def _stored_vectors(self, state):
+        if state.vectors is not None:
+            return np.asarray(state.vectors.matrix[:len(state.chunks)])
+        if state.index is None:
+            return None
+        return index_vectors(state.index, state.mapped)
+
+    def _vector_file(self, state, dimension):
+        # Vector file the next state can append to. Compressed storage needs the exact vectors on the side; they are
+        # seeded from a full-precision index (e.g. a snapshot written before the storage setting changed), and
+        # read-only snapshot files are copied. Appending to the current writable file is safe for readers, since
+        # their rows stay where they are.
+        if self.storage == "full":
+            return None
+        if state.vectors is None:
+            vectors = VectorFile(dimension, self.vector_dir)
+            if state.index is not None:
+                vectors.append(index_vectors(state.index, state.mapped))
+            return vectors
+        if state.vectors.readonly:
+            return state.vectors.writable_copy(self.vector_dir)
+        return state.vectors
+
+    def swap(self, index, chunks, vectors, mapped=False):
+        # Replace the whole state, e.g. with a freshly loaded snapshot
+        with self.write_lock:
+            self.state = StoreState(index, chunks, vectors, self.state.version + 1, self.rerank_factor, mapped)
+            return self.state
+
+    def _appended(self, state, docs, vectors):
+        if not docs:
+            return state
+        total = len(state.chunks) + len(docs)
+        vector_file = self._vector_file(state, vectors.shape[1])
+        if state.index is not None and not self._needs_rebuild(state.index, total):
+            # The current index keeps serving readers; the copy gets the new rows (this also copies mapped
+            # snapshot indexes into memory)
+            index = copy_index(state.index, state.mapped)
+            index.add(vectors)
+        else:
+            existing = self._stored_vectors(state)
+            index = self._build(vectors if existing is None else np.vstack([existing, vectors]))
+        if vector_file is not None:
+            vector_file.append(vectors)
+        return StoreState(index, state.chunks.extend(docs), vector_file, state.version + 1, self.rerank_factor)
+
+    def _removed(self, state, sources):
+        rows = state.chunks.rows_of(sources)
+        if not len(rows):
+            return state, 0
+        remaining = len(state.chunks) - len(rows)
+        keep = np.ones(len(state.chunks), dtype=bool)
+        keep[rows] = False
+        if index_kind(state.index) == "flat" and not self._needs_rebuild(state.index, remaining):
+            # Flat indexes (full or coded) compact the remaining rows in order, so filtering the chunks the
+            # same way keeps them aligned
+            index = copy_index(state.index, state.mapped)
+            index.remove_ids(rows.astype(np.int64))
+        else:
+            index = self._build(self._stored_vectors(state)[keep])
+        vector_file = None
+        if self.storage != "full":
+            # Readers of the current state still use its rows, so the kept rows go to a new file
+            source_file = state.vectors
+            if source_file is None:
+                source_file = self._vector_file(state, state.index.d)
+            vector_file = source_file.writable_copy(self.vector_dir, keep)
+        return StoreState(index, state.chunks.select(keep), vector_file, state.version + 1, self.rerank_factor), len(rows)
+
+    def append(self, docs, vectors):
+        if not docs:
+            return 0
+        with self.write_lock:
+            self.state = self._appended(self.state, docs, vectors)
+        return len(docs)
+
+    def add_documents(self, docs):
+        added = self.append(docs, self.embed(docs))
+        logger.info(f"Appended {added} chunks to the FAISS index ({len(self)} total).")
+        return added
+
+    def remove_sources(self, sources):
+        with self.write_lock:
+            self.state, removed = self._removed(self.state, set(sources))
+        if removed:
+            logger.info(f"Removed {removed} chunks from the FAISS index ({len(self)} total).")
+        return removed
+
+    def remove_source(self, source):
+        return self.remove_sources([source])
+
+    def replace_sources(self, docs_by_source, vectors=None):
+        # Embed first so a failed embedding call leaves the previous chunks of these sources in place;
+        # callers that embedded the chunks already (e.g. ingestion jobs) pass the vectors in row order.
+        # Removal and append are swapped in together, so readers never see the sources missing.
+        new_docs = [doc for docs in docs_by_source.values() for doc in docs]
+        if vectors is None:
+            vectors = self.embed(new_docs)
+        with self.write_lock:
+            state, removed = self._removed(self.state, set(docs_by_source))
+            self.state = self._appended(state, new_docs, vectors)
+        logger.info(f"Replaced {removed} chunks with {len(new_docs)} new chunks ({len(self)} total).")
+        return len(new_docs), removed
+
+    def replace_source(self, source, docs):
+        return self.replace_sources({source: docs})
+
+    def search(self, query_embedding, k=5, nprobe=None, ef_search=None):
+        return self.state.search(query_embedding, k=k, nprobe=nprobe, ef_search=ef_search)
+
+    def search_many(self, query_embeddings, k=5, nprobe=None, ef_search=None):
+        return self.state.search_many(query_embeddings, k=k, nprobe=nprobe, ef_search=ef_search)
+
+    def retrieve_many(self, query_embeddings, k=5, nprobe=None, ef_search=None):
+        return self.state.retrieve_many(query_embeddings, k=k, nprobe=nprobe, ef_search=ef_search)